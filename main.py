@@ -1,5 +1,4 @@
-import tkinter as tk                                                        # Библиотека для GUI
-from tkinter import scrolledtext                                            # виджет текстового поля с полосой прокуртки
+import sys
 import getpass                                                              # Для имени пользователя
 import socket                                                               # Для имени компьютера
 import shlex                                                                # парсер, который разбивает строку как shell (учитывает кавычки)
@@ -7,40 +6,650 @@ import argparse                                                             # Д
 import zipfile                                                              # Для работы с zip файлами (чтение/запись)
 import io                                                                   # Для работы с данными в файле прямо в памяти
 import os
-from dataclasses import dataclass, field                                    # Упрощает работу, не нужно описывать init, repr
-from typing import Dict, Optional                                           # Словарь, опциональные значения
-@dataclass
+import struct                                                               # Разбор локального заголовка записи ZIP
+import itertools
+import fnmatch                                                              # Шаблоны имен для find
+import re                                                                   # Регулярные выражения для grep
+import hashlib                                                              # Хеш скрипта для проверки кэша
+import json                                                                 # Кэш разобранных скриптов на диске
+import time                                                                 # Замер времени команд
+import threading                                                            # Фоновая загрузка VFS в GUI
+import queue                                                                # Сообщения фонового загрузчика в поток Tk
+import asyncio                                                              # Сервер сессий
+import shutil                                                               # Копирование архива при сохранении в новый файл
+import warnings
+import bisect                                                               # Вставка имени в отсортированный список детей
+from collections import OrderedDict, deque                                  # Упорядоченный словарь для LRU-кэша, очередь вывода
+from array import array                                                     # Плотные числовые массивы для компактного дерева
+from concurrent.futures import ThreadPoolExecutor                           # Параллельная распаковка при загрузке (zlib отпускает GIL)
+from collections.abc import Mapping, Sequence
+from typing import Dict, List, NamedTuple, Optional                         # Словарь, опциональные значения
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024                                      # Бюджет кэша распакованных файлов в ленивом режиме (64 МБ)
+TAC_CHUNK_SIZE = 64 * 1024                                                  # Размер блока, которым tac читает файл с конца
+DEFAULT_SCROLLBACK = 10000                                                  # Сколько последних строк хранит окно вывода
+DEFAULT_DCACHE_SIZE = 4096                                                  # Сколько разрешенных путей помнит кэш путь -> узел
+DEFAULT_LOAD_BATCH_BYTES = 4 * 1024 * 1024                                  # Сколько сжатых байт распаковывает одна задача пула при загрузке
+LINE_BREAK = re.compile(rb"\r\n|\r|\n")                                       # Переводы строк для tac - те же, что у head (TextIOWrapper, newline=None)
+GREP_META = set(".^$*+?{}[]\\|()")                                          # Без этих символов шаблон grep - простая подстрока
+STATS_SAMPLES = 10000                                                       # Сколько последних замеров на команду хранится для p99
+DEFAULT_SERVER_PORT = 7777
+SERVER_END = "\x1e"                                                         # Начало строки-терминатора ответа сервера: "\x1e0" - успех, "\x1e1" - ошибка; ведущий "\x1e" в выводе удваивается
+SERVER_CHUNK_BYTES = 64 * 1024                                              # Вывод команды уходит клиенту пачками такого размера
+SERVER_CHUNKS_IN_FLIGHT = 4                                                 # Сколько пачек сессии ждут отправки; дальше команда ждет, пока клиент читает
+DEFAULT_SERVER_WORKERS = 32                                                 # Потоков для выполнения команд сессий
+INDEX_SUFFIX = ".idx"                                                       # Файл индекса лежит рядом с архивом: vfs.zip -> vfs.zip.idx
+INDEX_MAGIC = b"VFSIDX\x00\x02"                                             # Версия 2: дети каталога - сначала каталоги, затем файлы
+INDEX_HEADER = struct.Struct("<8sBqqiiqq")                                  # magic, порядок байт, размер и mtime архива, узлов, записей, длины блоков имен
+
+
 class VNode:                                                                # Хранит данные о файле или каталоге, строит дерево каталогов, добавляет файлы
-    name: str                                                               # имя элемента (файла/каталога), без полного пути
-    is_dir: bool                                                            # флаг, чтобы отличать файл от каталога
-    children: Dict[str, "Vnode"] = field(default_factory=dict)              # Дочерние узлы. Словарь (имя - узел) для каждого каталога. Создаем новый пустой словарь для каждого экземпляра
-    data: bytes = b""                                                       # Содержимое файла; для каталога - пусто
+    __slots__ = ("name", "is_dir", "children", "data", "zinfo", "parent", "total_size", "file_count", "listing")   # Без __dict__ у каждого узла
+
+    def __init__(self, name: str, is_dir: bool, children: Optional[Dict[str, "VNode"]] = None, data: bytes = b"",
+                 zinfo: Optional[zipfile.ZipInfo] = None, parent: Optional["VNode"] = None):
+        self.name = sys.intern(name)                                        # имя элемента (файла/каталога), без полного пути; одинаковые имена хранятся один раз
+        self.is_dir = is_dir                                                # флаг, чтобы отличать файл от каталога
+        self.children = (children if children is not None else {}) if is_dir else None   # Дочерние узлы (имя - узел); у файла словаря нет
+        self.data = data                                                    # Содержимое файла; для каталога - пусто
+        self.zinfo = zinfo                                                  # Запись архива (ленивый режим): данные распаковываются при первом чтении
+        self.parent = parent                                                # Родительский каталог (для обновления агрегатов вверх по цепочке)
+        self.total_size = 0                                                 # Для каталога: суммарный размер файлов в поддереве
+        self.file_count = 0                                                 # Для каталога: число файлов в поддереве
+        self.listing = None                                                 # Для каталога: (имена каталогов, имена файлов) по алфавиту; строится при первом ls
+
+    def __repr__(self):
+        return f"VNode(name={self.name!r}, is_dir={self.is_dir})"
+
+    @property
+    def size(self):                                                         # Размер файла в байтах, не распаковывая его
+        info = self.zinfo                                                   # Одно чтение: фоновая загрузка может сбросить zinfo между двумя
+        return info.file_size if info is not None else len(self.data)
 
     def ensure_dir(self, parts):                                            # Обеспечивает, что по пути parts существует цепочка каталогов. Возвращает узел последленго каталога
         node = self                                                         # Начинаем с текущего узла
         for p in parts:                                                     # Идем по пути
             if p not in node.children:                                      # Если не нашли такой каталог
-                node.children[p] = VNode(p, True)                           # Создаем новый
+                node.add_dir(p)                                             # Создаем новый
             node = node.children[p]
             if not node.is_dir:                                             # Если не каталог (файл)
                 raise ValueError(f"Путь содержит файл как каталог: {p}")
         return node
-    def add_file(self, parts, data: bytes):                                 # Добавляет файл по пути parts и записывает его содержимое data
+    def add_dir(self, name):                                                # Создает пустой дочерний каталог (агрегаты не меняются)
+        child = VNode(name, True, parent=self)
+        self.children[name] = child
+        if self.listing is not None:
+            bisect.insort(self.listing[0], child.name)
+        return child
+
+    def sorted_children(self):                                              # (каталоги, файлы) по алфавиту: сортировка один раз, дальше список поддерживается вставками
+        if self.listing is None:
+            dirs, files = [], []
+            for name, child in self.children.items():
+                (dirs if child.is_dir else files).append(name)
+            dirs.sort()
+            files.sort()
+            self.listing = (dirs, files)
+        return self.listing
+
+    def add_file(self, parts, data: bytes = b"", zinfo=None, propagate=True):   # Добавляет файл по пути parts и записывает его содержимое data (или ссылку на запись архива)
         *dirs, filename = parts
         parent = self.ensure_dir(dirs)                                      # Находим узел родитель
-        parent.children[filename] = VNode(filename, False, data=data)       # Создаем файл
+        node = VNode(filename, False, data=data, zinfo=zinfo, parent=parent)
+        old = parent.children.get(filename)
+        parent.children[filename] = node                                    # Создаем файл
+        if parent.listing is not None and (old is None or old.is_dir):
+            dirs, files = parent.listing
+            if old is not None:                                             # Файл заменил каталог с тем же именем
+                del dirs[bisect.bisect_left(dirs, filename)]
+            bisect.insort(files, node.name)
+        if propagate:                                                       # При загрузке архива агрегаты считаются один раз в конце (recompute_totals)
+            if old is None:
+                parent.propagate(node.size, 1)
+            elif old.is_dir:
+                parent.propagate(node.size - old.total_size, 1 - old.file_count)
+            else:
+                parent.propagate(node.size - old.size, 0)
+        return node
+
+    def propagate(self, size_delta, count_delta):                           # Обновляет агрегаты этого каталога и всех предков: O(глубины)
+        node = self
+        while node is not None:
+            node.total_size += size_delta
+            node.file_count += count_delta
+            node = node.parent
+
+    def recompute_totals(self):                                             # Пересчитывает агрегаты всего поддерева одним обходом без рекурсии
+        order = []                                                          # Каталоги в порядке обхода: родитель раньше потомков
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            for child in node.children.values():
+                if child.is_dir:
+                    stack.append(child)
+        for node in reversed(order):                                        # Потомки обрабатываются раньше родителей
+            size = count = 0
+            for child in node.children.values():
+                if child.is_dir:
+                    size += child.total_size
+                    count += child.file_count
+                else:
+                    size += child.size
+                    count += 1
+            node.total_size = size
+            node.file_count = count
+
+
+class NodeTable:                                                            # Компактное дерево в массивах: узел - это индекс, без Python-объекта на каждый элемент
+    def __init__(self, parent, first_child, child_count, dir_count, flags, size, file_count, member, name_off, names, infos):
+        self.parent = parent                                                # array('i'): индекс родителя (-1 у корня)
+        self.first_child = first_child                                      # array('i'): индекс первого ребенка; дети каталога идут подряд: сначала каталоги, затем файлы, внутри - по имени
+        self.child_count = child_count                                      # array('i'): число детей
+        self.dir_count = dir_count                                          # array('i'): сколько из них каталоги
+        self.flags = flags                                                  # bytearray: 1 - каталог
+        self.size = size                                                    # array('q'): размер файла / суммарный размер поддерева каталога
+        self.file_count = file_count                                        # array('i'): число файлов в поддереве
+        self.member = member                                                # array('i'): номер записи в infos (-1 у каталога)
+        self.name_off = name_off                                            # array('i'): смещения имен в names (N + 1 элементов)
+        self.names = names                                                  # bytes: все имена подряд в UTF-8
+        self.infos = infos                                                  # Записи архива для чтения данных
+
+    def __len__(self):
+        return len(self.flags)
+
+    @staticmethod
+    def build(infos) -> "NodeTable":                                        # Строит таблицу по записям центрального каталога ZIP
+        dirs: Dict[str, list] = {"": []}                                    # путь каталога -> [(имя ребенка, номер записи или -1 для каталога)]
+
+        def ensure(path):                                                   # Регистрирует каталог и всех его недостающих предков
+            missing = []
+            while path not in dirs:
+                missing.append(path)
+                path = path.rpartition("/")[0]
+            for d in reversed(missing):
+                dirs[d] = []
+                parent, _, name = d.rpartition("/")
+                dirs[parent].append((name, -1))
+
+        for i, info in enumerate(infos):
+            p = info.filename
+            parts = [x for x in p.split("/") if x]
+            if not parts:
+                continue
+            if p.endswith("/"):
+                ensure("/".join(parts))
+            else:
+                parent = "/".join(parts[:-1])
+                ensure(parent)
+                dirs[parent].append((parts[-1], i))
+
+        parent_arr, first_child, child_count, dir_count = array("i", [-1]), array("i", [0]), array("i", [0]), array("i", [0])
+        flags, size, file_count, member = bytearray(b"\x01"), array("q", [0]), array("i", [0]), array("i", [-1])
+        chunks = [b"/"]
+        name_off = array("i", [0, 1])
+        pending_dirs = deque([("", 0)])                                     # Обход в ширину: дети каждого каталога получают соседние индексы
+        while pending_dirs:
+            path, idx = pending_dirs.popleft()
+            children = sorted(dirs.pop(path), key=lambda c: c[0].encode("utf-8"))   # Порядок байт UTF-8, как в бинарном поиске
+            deduped = []
+            for name, m in children:                                        # Одинаковые имена: повтор файла - берем последнюю запись, файл и каталог - ошибка
+                if deduped and deduped[-1][0] == name:
+                    if (deduped[-1][1] < 0) != (m < 0):
+                        raise ValueError(f"Путь содержит файл как каталог: {name}")
+                    if m > deduped[-1][1]:
+                        deduped[-1] = (name, m)
+                    continue
+                deduped.append((name, m))
+            ordered = [c for c in deduped if c[1] < 0]                      # Каталоги перед файлами: ls выводит страницу срезом без сортировки
+            dir_count[idx] = len(ordered)
+            ordered += [c for c in deduped if c[1] >= 0]
+            first_child[idx] = len(flags)
+            child_count[idx] = len(ordered)
+            for name, m in ordered:
+                n = len(flags)
+                encoded = name.encode("utf-8")
+                chunks.append(encoded)
+                name_off.append(name_off[-1] + len(encoded))
+                parent_arr.append(idx)
+                first_child.append(0)
+                child_count.append(0)
+                dir_count.append(0)
+                if m < 0:
+                    flags.append(1)
+                    size.append(0)
+                    file_count.append(0)
+                    member.append(-1)
+                    pending_dirs.append((f"{path}/{name}" if path else name, n))
+                else:
+                    flags.append(0)
+                    size.append(infos[m].file_size)
+                    file_count.append(1)
+                    member.append(m)
+        for n in range(len(flags) - 1, 0, -1):                              # Дети всегда после родителя: агрегаты одним проходом с конца
+            p = parent_arr[n]
+            size[p] += size[n]
+            file_count[p] += file_count[n]
+        return NodeTable(parent_arr, first_child, child_count, dir_count, flags, size, file_count, member, name_off, b"".join(chunks), infos)
+
+    def name(self, idx: int) -> str:
+        return self.names[self.name_off[idx]:self.name_off[idx + 1]].decode("utf-8")
+
+    def names_in(self, indices) -> List[str]:                               # Имена диапазона узлов одним проходом (для страницы ls)
+        names, off = self.names, self.name_off
+        return [names[off[n]:off[n + 1]].decode("utf-8") for n in indices]
+
+    def is_dir(self, idx: int) -> bool:
+        return self.flags[idx] == 1
+
+    def child(self, idx: int, name: str) -> int:                            # Бинарный поиск ребенка по имени среди каталогов, затем среди файлов; -1 - не найден
+        key = name.encode("utf-8")                                          # Порядок байт UTF-8 совпадает с порядком строк
+        first = self.first_child[idx]
+        split = first + self.dir_count[idx]
+        found = self._search(first, split, key)
+        return found if found >= 0 else self._search(split, first + self.child_count[idx], key)
+
+    def _search(self, lo: int, hi: int, key: bytes) -> int:
+        names, off = self.names, self.name_off
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = names[off[mid]:off[mid + 1]]
+            if cur < key:
+                lo = mid + 1
+            elif cur > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def children(self, idx: int):                                           # Индексы детей: сначала каталоги, затем файлы, внутри - по имени
+        start = self.first_child[idx]
+        return range(start, start + self.child_count[idx])
+
+    def lookup(self, abs_path: str, start: int = 0) -> int:                 # Индекс узла по нормализованному пути (относительно узла start); -1 - не найден
+        idx = start
+        if abs_path.strip("/") == "":
+            return idx
+        for p in abs_path.strip("/").split("/"):
+            if self.flags[idx] != 1:
+                return -1
+            idx = self.child(idx, p)
+            if idx < 0:
+                return -1
+        return idx
+
+    def to_vnodes(self) -> VNode:                                           # Переводит таблицу в дерево VNode (нужно для изменений)
+        nodes = []
+        for n in range(len(self)):
+            is_dir = self.flags[n] == 1
+            m = self.member[n]
+            p = self.parent[n]
+            node = VNode(self.name(n), is_dir, zinfo=self.infos[m] if m >= 0 else None, parent=nodes[p] if p >= 0 else None)
+            if is_dir:
+                node.total_size = self.size[n]
+                node.file_count = self.file_count[n]
+            if p >= 0:
+                nodes[p].children[node.name] = node
+            nodes.append(node)
+        return nodes[0]
+
+    def pack_members(self):                                                 # (номера записей, IndexedMembers): записи архива - плотные массивы вместо ZipInfo
+        if isinstance(self.infos, IndexedMembers):                          # Уже упакованы (таблица из индекса или после compact_members)
+            return self.member, self.infos
+        member = array("i", self.member)
+        header_offset, compress_size, file_size = array("q"), array("q"), array("q")
+        crc, compress_type, flag_bits = array("I"), array("H"), array("H")
+        fname_off = array("q", [0])
+        fnames = []
+        for n, m in enumerate(self.member):                                 # Записи каталогов не нужны: номера файлов перенумеровываются подряд
+            if m < 0:
+                continue
+            info = self.infos[m]
+            member[n] = len(header_offset)
+            header_offset.append(info.header_offset)
+            compress_size.append(info.compress_size)
+            file_size.append(info.file_size)
+            crc.append(info.CRC)
+            compress_type.append(info.compress_type)
+            flag_bits.append(info.flag_bits)
+            encoded = info.orig_filename.encode("utf-8")
+            fnames.append(encoded)
+            fname_off.append(fname_off[-1] + len(encoded))
+        return member, IndexedMembers(header_offset, compress_size, file_size, crc, compress_type, flag_bits, fname_off, b"".join(fnames))
+
+    def compact_members(self):                                              # Отпускает список ZipInfo: в компактном режиме он занимал больше самой таблицы
+        self.member, self.infos = self.pack_members()
+
+    def save(self, path: str, archive_stat: os.stat_result):                # Записывает таблицу в файл индекса; записи архива - только смещения и размеры
+        member, infos = self.pack_members()
+        header = INDEX_HEADER.pack(INDEX_MAGIC, sys.byteorder == "little", archive_stat.st_size, archive_stat.st_mtime_ns,
+                                   len(self), len(infos), len(self.names), len(infos.fnames))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            for arr in (self.parent, self.first_child, self.child_count, self.dir_count, self.flags, self.size, self.file_count, member, self.name_off,
+                        self.names, infos.header_offset, infos.compress_size, infos.file_size, infos.crc, infos.compress_type, infos.flag_bits,
+                        infos.fname_off, infos.fnames):
+                f.write(arr)                                                # array и bytes пишутся напрямую, без поэлементного кодирования
+        os.replace(tmp, path)                                               # Атомарная замена, как у кэша скриптов
+
+    @staticmethod
+    def load(path: str, archive_stat: os.stat_result) -> Optional["NodeTable"]:   # Таблица из файла индекса; None - индекса нет или он устарел
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            return None
+        if len(raw) < INDEX_HEADER.size:
+            return None
+        magic, little, size, mtime, n, m, names_len, fnames_len = INDEX_HEADER.unpack_from(raw)
+        if (magic != INDEX_MAGIC or bool(little) != (sys.byteorder == "little")
+                or size != archive_stat.st_size or mtime != archive_stat.st_mtime_ns):   # Архив изменился после записи индекса
+            return None
+        view = memoryview(raw)
+        pos = INDEX_HEADER.size
+
+        def take(typecode, count):
+            nonlocal pos
+            if typecode is None:
+                end = pos + count
+                chunk = bytes(view[pos:end])
+            else:
+                arr = array(typecode)
+                end = pos + count * arr.itemsize
+                chunk = arr
+                arr.frombytes(view[pos:end])
+            if end > len(raw):
+                raise ValueError("Индекс VFS обрезан")
+            pos = end
+            return chunk
+
+        try:
+            parent, first_child, child_count, dir_count = take("i", n), take("i", n), take("i", n), take("i", n)
+            flags = bytearray(take(None, n))
+            size, file_count, member, name_off = take("q", n), take("i", n), take("i", n), take("i", n + 1)
+            names = take(None, names_len)
+            infos = IndexedMembers(take("q", m), take("q", m), take("q", m), take("I", m), take("H", m), take("H", m),
+                                   take("q", m + 1), take(None, fnames_len))
+        except ValueError:
+            return None
+        if pos != len(raw):
+            return None
+        return NodeTable(parent, first_child, child_count, dir_count, flags, size, file_count, member, name_off, names, infos)
+
+
+class IndexedMembers(Sequence):                                             # Записи архива из файла индекса: ZipInfo создается при первом обращении к файлу
+    def __init__(self, header_offset, compress_size, file_size, crc, compress_type, flag_bits, fname_off, fnames):
+        self.header_offset = header_offset
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.crc = crc
+        self.compress_type = compress_type
+        self.flag_bits = flag_bits
+        self.fname_off = fname_off                                          # Смещения полных имен записей в fnames (M + 1 элементов)
+        self.fnames = fnames
+        self._made: Dict[int, zipfile.ZipInfo] = {}                         # Один объект на запись: он же ключ кэша распакованных данных
+
+    def __len__(self):
+        return len(self.header_offset)
+
+    def __getitem__(self, m):
+        info = self._made.get(m)
+        if info is None:
+            info = zipfile.ZipInfo(self.fnames[self.fname_off[m]:self.fname_off[m + 1]].decode("utf-8"))
+            info.header_offset = self.header_offset[m]
+            info.compress_size = self.compress_size[m]
+            info.file_size = self.file_size[m]
+            info.CRC = self.crc[m]
+            info.compress_type = self.compress_type[m]
+            info.flag_bits = self.flag_bits[m]
+            self._made[m] = info
+        return info
+
+
+class TableChildren(Mapping):                                               # Только для чтения: дети узла таблицы как словарь имя -> узел
+    __slots__ = ("table", "idx")
+
+    def __init__(self, table: NodeTable, idx: int):
+        self.table = table
+        self.idx = idx
+
+    def __getitem__(self, name):
+        n = self.table.child(self.idx, name)
+        if n < 0:
+            raise KeyError(name)
+        return TableNode(self.table, n)
+
+    def __contains__(self, name):
+        return self.table.child(self.idx, name) >= 0
+
+    def __iter__(self):
+        return (self.table.name(n) for n in self.table.children(self.idx))
+
+    def __len__(self):
+        return self.table.child_count[self.idx]
+
+
+class TableNode:                                                            # Легкое представление узла таблицы с тем же интерфейсом, что у VNode (только чтение)
+    __slots__ = ("table", "idx")
+    data = b""
+
+    def __init__(self, table: NodeTable, idx: int):
+        self.table = table
+        self.idx = idx
+
+    def __eq__(self, other):
+        return isinstance(other, TableNode) and other.table is self.table and other.idx == self.idx
+
+    def __hash__(self):
+        return hash((id(self.table), self.idx))
+
+    name = property(lambda self: self.table.name(self.idx))
+    is_dir = property(lambda self: self.table.flags[self.idx] == 1)
+    size = property(lambda self: self.table.size[self.idx])
+    total_size = property(lambda self: self.table.size[self.idx])
+    file_count = property(lambda self: self.table.file_count[self.idx])
+
+    @property
+    def children(self):
+        return TableChildren(self.table, self.idx) if self.is_dir else None
+
+    @property
+    def zinfo(self):
+        m = self.table.member[self.idx]
+        return self.table.infos[m] if m >= 0 else None
+
+    @property
+    def parent(self):
+        p = self.table.parent[self.idx]
+        return TableNode(self.table, p) if p >= 0 else None
+
+
+class PayloadCache:                                                         # LRU-кэш распакованных файлов с ограничением по суммарному объему в байтах
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0                                                       # Сколько байт сейчас занято
+        self._items: "OrderedDict[zipfile.ZipInfo, bytes]" = OrderedDict()  # Порядок = давность использования (в конце - самые свежие)
+        self._lock = threading.Lock()                                       # Кэш общий для сессий сервера, а их команды выполняются в разных потоках
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)                                # Отмечаем как недавно использованный
+            return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:                                      # Не влезает в бюджет целиком - не кэшируем
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.used -= len(old)
+            self._items[key] = data
+            self.used += len(data)
+            while self.used > self.max_bytes:                               # Вытесняем самые старые записи
+                _, evicted = self._items.popitem(last=False)
+                self.used -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.used = 0
+
+
+def open_member(f, info: zipfile.ZipInfo, close_fileobj: bool = False):   # Поток распакованных данных записи по ее смещению в файлоподобном объекте f
+    if info.flag_bits & 0x1:
+        raise RuntimeError(f"Файл зашифрован: {info.filename}")
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if len(header) != 30 or header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile("Неверный локальный заголовок записи")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    f.seek(name_len + extra_len, os.SEEK_CUR)
+    return zipfile.ZipExtFile(f, "r", info, None, close_fileobj)            # Распаковка и проверка CRC - средствами zipfile
+
+
+class IndexedArchive:                                                       # Чтение записей по смещениям из индекса: центральный каталог ZIP не разбирается
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def open(self, info: zipfile.ZipInfo):                                  # Поток распакованных данных записи (как ZipFile.open)
+        f = open(self.filename, "rb")                                       # Свой дескриптор на каждый поток: общей позиции нет
+        try:
+            return open_member(f, info, close_fileobj=True)                 # Дескриптор закрывается вместе с потоком
+        except Exception:
+            f.close()
+            raise
+
+    def read(self, info: zipfile.ZipInfo) -> bytes:
+        with self.open(info) as f:
+            return f.read()
+
+    def close(self):                                                        # Открытых дескрипторов нет
+        pass
 
 
 class VFS:                                                                  # Хранит дерево узлов, имя, хеш, текущий каталог
-    def __init__(self, name: str, raw_zip_bytes: bytes, root: VNode):
+    def __init__(self, name: str, raw_zip_bytes: Optional[bytes], root: Optional[VNode], archive: Optional[zipfile.ZipFile] = None,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES, table: Optional[NodeTable] = None, path: Optional[str] = None):
         self.name = name
-        self._raw_zip_bytes = raw_zip_bytes
-        self.root = root
+        self.path = path                                                # Файл архива на диске (у дефолтной VFS - None)
+        self._raw_zip_bytes = raw_zip_bytes                             # В ленивом режиме None: держим открытый архив, а не его байты
+        self._archive = archive                                         # Открытый ZipFile, из которого распаковываются файлы по требованию
+        self._cache = PayloadCache(cache_bytes)                         # Кэш распакованных данных для ленивого режима
+        self.table = table                                              # Компактный режим: дерево хранится в NodeTable, а не в VNode
+        self.root = TableNode(table, 0) if table is not None else root
         self.cwd = "/"                                                  # Текущий рабочий каталог
+        self._cwd_node = self.root                                      # Узел текущего каталога: относительные пути разрешаются от него, а не от корня
+        self._dcache: "OrderedDict[str, VNode]" = OrderedDict()         # Кэш путь -> узел (как dentry cache), порядок = давность использования
+        self.dcache_size = DEFAULT_DCACHE_SIZE                          # Лимит записей; 0 - кэш выключен
+        self.dcache_hits = 0
+        self.dcache_misses = 0
+        self.bytes_decompressed = 0                                     # Сколько байт распаковано из архива (для stats)
+        self.bytes_decoded = 0                                          # Сколько байт декодировано в текст
+        self._pending: Dict[str, VNode] = {}                            # Узлы, добавленные после загрузки/sync (абсолютный путь -> узел), в порядке создания
+        self.use_index = False                                          # sync обновляет файл индекса рядом с архивом
+        self._names: Optional[Dict[str, list]] = None                   # Индекс имя -> узлы для find; строится при первом find от корня
+        self._fingerprints: Dict[object, int] = {}                      # Маска символов файла для grep: файлы без нужных символов не распаковываются
+        self._owned: Optional[set] = None                               # Сессия сервера: каталоги, скопированные из общего дерева (None - дерево свое целиком)
+
+    def _thaw(self):                                                    # Перед изменением дерева компактная таблица переводится в VNode
+        if self.table is not None:
+            self.root = self.table.to_vnodes()
+            self.table = None
+            self._invalidate()                                          # Все закэшированные узлы относились к таблице
+            self._cwd_node = self._walk(self.cwd, self.root)
+            self._names = None                                          # Индекс имен тоже ссылался на узлы таблицы
+
+    def _added(self, abs_path: str, node: VNode, replaced: Optional[VNode] = None):   # Учет нового узла: очередь sync и индекс имен
+        self._pending[abs_path] = node
+        if self._owned is not None:                                     # Новый узел принадлежит сессии: копировать его не нужно
+            self._owned.add(node)
+        if self._names is not None:
+            bucket = self._names.setdefault(node.name, [])
+            if replaced is not None and replaced in bucket:
+                bucket.remove(replaced)
+            bucket.append(node)
+
+    def fork(self) -> "VFS":                                            # Сессия поверх этого дерева: свой cwd и кэш путей, изменения - копированием при записи
+        self._thaw()                                                    # Общая база - дерево VNode (таблица переводится один раз, до раздачи сессиям)
+        session = VFS(name=self.name, raw_zip_bytes=self._raw_zip_bytes, root=self.root, archive=self._archive, path=self.path)
+        session._cache = self._cache                                    # Распакованные данные и отпечатки grep общие: содержимое файлов базы не меняется
+        session._fingerprints = self._fingerprints
+        session.dcache_size = self.dcache_size
+        session._owned = set()
+        return session
+
+    def _make_private(self, parts):                                     # Копирует общие каталоги от корня вдоль parts, чтобы их можно было менять
+        if self._owned is None:
+            return
+        copied = False
+        node = self.root
+        if node not in self._owned:
+            node = self.root = self._copy_dir(node, None)
+            copied = True
+        for p in parts:
+            child = node.children.get(p)
+            if child is None or not child.is_dir:
+                break
+            if child not in self._owned:
+                child = node.children[p] = self._copy_dir(child, node)
+                copied = True
+            node = child
+        if copied:                                                      # Кэш путей и cwd могли указывать на общие узлы, которые теперь заменены копиями
+            self._invalidate()
+            self._names = None
+            self._cwd_node = self._walk(self.cwd, self.root)
+
+    def _copy_dir(self, node: VNode, parent: Optional[VNode]) -> VNode:   # Копия каталога: словарь детей копируется, сами дети остаются общими
+        copy = VNode(node.name, True, children=dict(node.children), parent=parent)
+        copy.total_size = node.total_size
+        copy.file_count = node.file_count
+        if node.listing is not None:
+            copy.listing = (list(node.listing[0]), list(node.listing[1]))
+        self._owned.add(copy)
+        return copy
+
+    def _invalidate(self, abs_path: Optional[str] = None):              # Сбрасывает кэш путей: целиком или для поддерева abs_path
+        if abs_path is None or abs_path == "/":
+            self._dcache.clear()
+            return
+        prefix = abs_path + "/"
+        for key in [k for k in self._dcache if k == abs_path or k.startswith(prefix)]:
+            del self._dcache[key]
+
+    def dcache_stats(self):                                             # Счетчики кэша путей для подбора его размера
+        total = self.dcache_hits + self.dcache_misses
+        return {"hits": self.dcache_hits, "misses": self.dcache_misses, "entries": len(self._dcache),
+                "capacity": self.dcache_size, "hit_rate": self.dcache_hits / total if total else 0.0}
+
+    def close(self):                                                    # Закрывает архив ленивого режима
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+        self._cache.clear()
+
+    def _read_bytes(self, node: VNode) -> bytes:                        # Содержимое файла: из памяти или распаковкой из архива через кэш
+        info = node.zinfo                                               # Читается один раз: фоновая загрузка сбрасывает zinfo после записи data
+        if info is None:
+            return node.data
+        data = self._cache.get(info)
+        if data is None:
+            if self._archive is None:
+                raise RuntimeError("Архив VFS закрыт")
+            data = self._archive.read(info)
+            self.bytes_decompressed += len(data)
+            self._cache.put(info, data)
+        return data
     def _normalize_path(self, path: Optional[str]):
         if not path or path == ".":                                     # Пустой путь или текущий каталог
-            current = self.cwd
-        elif path.startswith("/"):                                      # Если абсолютный путь, то берем как есть
+            return self.cwd
+        if "//" not in path and "/." not in "/" + path:                 # Нет ".", ".." и двойных слешей: список частей собирать не нужно
+            if path.startswith("/"):
+                return path.rstrip("/") or "/"
+            return (self.cwd if self.cwd != "/" else "") + "/" + path.rstrip("/")
+        if path.startswith("/"):                                        # Если абсолютный путь, то берем как есть
             current = path
         else:                                                           # Относительный путь надо присоединить к текущему каталогу self.cwd
             current = self.cwd.rstrip("/") + "/" + path if self.cwd != "/" else "/" + path      # Если cwd == "/", то делаем "/" + path, иначе делаем очистку переднего слеша + "/" + path
@@ -56,16 +665,39 @@ class VFS:                                                                  # Х
         return "/" + "/".join(parts) if parts else "/"
 
     def _get_node(self, abs_path: str):
-        if abs_path == "/":
-            return self.root
-        node = self.root
-        for p in abs_path.strip("/").split("/"):
+        node = self._dcache.get(abs_path)
+        if node is not None:
+            self.dcache_hits += 1
+            self._dcache.move_to_end(abs_path)
+            return node
+        self.dcache_misses += 1
+        cwd = self.cwd
+        if cwd != "/" and abs_path.startswith(cwd) and (len(abs_path) == len(cwd) or abs_path[len(cwd)] == "/"):
+            node = self._walk(abs_path[len(cwd):], self._cwd_node)      # Путь внутри текущего каталога: идем от него, а не от корня
+        else:
+            node = self._walk(abs_path, self.root)
+        if node is None:
+            raise FileNotFoundError(f"Путь не найден: {abs_path}")
+        if self.dcache_size > 0:                                        # Отрицательные результаты не кэшируются: добавление узлов кэш не портит
+            self._dcache[abs_path] = node
+            if len(self._dcache) > self.dcache_size:
+                self._dcache.popitem(last=False)                        # Вытесняем самый давно использованный путь
+        return node
+
+    def _walk(self, rel_path: str, start):                              # Спуск от узла start по частям пути; None - не найден
+        if self.table is not None:
+            idx = self.table.lookup(rel_path, start.idx)
+            return TableNode(self.table, idx) if idx >= 0 else None
+        node = start
+        rel_path = rel_path.strip("/")
+        if not rel_path:
+            return node
+        for p in rel_path.split("/"):
             if not node.is_dir or p not in node.children:
-                raise FileNotFoundError(f"Путь не найден: {abs_path}")
+                return None
             node = node.children[p]
         return node
 
-
     def _iter_dir_children(self, dir_node: VNode):
         if not dir_node.is_dir:
             raise NotADirectoryError("Не каталог")
@@ -73,53 +705,193 @@ class VFS:                                                                  # Х
             yield name, child
 
     def ls(self, path = "."):
+        items, target, _ = self.ls_page(path)
+        return items, target
+
+    def ls_page(self, path=".", offset: int = 0, limit: Optional[int] = None):   # Страница листинга (каталоги, затем файлы по алфавиту), путь и общее число детей
         target = self._normalize_path(path)
         node = self._get_node(target)
         if not node.is_dir:
             raise NotADirectoryError(f"'{target}' не является директорией")
-        items =[]
-        for name, child in self._iter_dir_children(node):
-            t = "d" if child.is_dir else "f"
-            items.append((t, name))
-        items.sort(key=lambda x: (x[0] != "d", x[1]))               # Сначала каталоги, потом файлы
-        return items, target
+        if self.table is not None:                                      # В таблице дети уже лежат в нужном порядке: страница - срез диапазона индексов
+            t = self.table
+            first, ndirs, total = t.first_child[node.idx], t.dir_count[node.idx], t.child_count[node.idx]
+            dirs = t.names_in(range(first, first + ndirs)[offset:None if limit is None else offset + limit])
+            files = range(first + ndirs, first + total)
+        else:
+            dirs, files = node.sorted_children()
+            total = len(dirs) + len(files)
+            dirs = dirs[offset:None if limit is None else offset + limit]
+        rest = None if limit is None else limit - len(dirs)
+        file_offset = max(0, offset - (total - len(files)))
+        files = files[file_offset:None if rest is None else file_offset + rest]
+        if self.table is not None:
+            files = self.table.names_in(files)
+        return [("d", n) for n in dirs] + [("f", n) for n in files], target, total
     def cd(self, path):
         target = self._normalize_path(path or "/")
         node = self._get_node(target)
         if not node.is_dir:
             raise NotADirectoryError(f"'{target}' не является директорией")
         self.cwd = target
-    def read_text(self, path):
+        self._cwd_node = node
+    def _file_node(self, path):                                         # Узел файла по пути; для каталога - ошибка
         abs_path = self._normalize_path(path)
         node = self._get_node(abs_path)
         if node.is_dir:
             raise NotADirectoryError(f"'{abs_path}' является директорией")
-        return node.data.decode("utf-8", errors="replace")
+        return node
+
+    def read_text(self, path):
+        data = self._read_bytes(self._file_node(path))
+        self.bytes_decoded += len(data)
+        return data.decode("utf-8", errors="replace")
+
+    def _open_stream(self, node: VNode):                                # Бинарный поток содержимого файла без полной распаковки
+        info = node.zinfo                                               # Читается один раз, как в _read_bytes
+        if info is None:
+            return io.BytesIO(node.data)
+        data = self._cache.get(info)
+        if data is not None:
+            return io.BytesIO(data)
+        if self._archive is None:
+            raise RuntimeError("Архив VFS закрыт")
+        return self._archive.open(info)                                 # Распаковка идет по мере чтения
+
+    def iter_lines(self, path):                                         # Строки файла по одной; память зависит от размера блока, а не файла
+        node = self._file_node(path)                                    # Ошибки пути - сразу, а не при первой итерации
+        return self._gen_lines(node)
+
+    def _gen_lines(self, node: VNode):
+        with self._open_stream(node) as raw:
+            try:
+                text = io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline=None)  # Инкрементальное декодирование, \r\n и \r приводятся к \n
+                for line in text:
+                    yield line[:-1] if line.endswith("\n") else line
+            finally:                                                    # Счетчики - по фактически прочитанному, даже если head остановился раньше
+                try:
+                    consumed = raw.tell()
+                except (OSError, ValueError):
+                    consumed = 0
+                self.bytes_decoded += consumed
+                if not isinstance(raw, io.BytesIO):                     # Поток из архива: байты распакованы по мере чтения
+                    self.bytes_decompressed += consumed
+
+    def iter_lines_reversed(self, path, chunk_size: int = TAC_CHUNK_SIZE):   # Строки файла с конца, чтение блоками по chunk_size
+        node = self._file_node(path)
+        info = node.zinfo
+        start = self._stored_data_offset(info)
+        if start is not None:                                           # Несжатая запись: читаем блоки прямо из файла архива
+            return self._gen_stored_reversed(info, start, chunk_size)
+        data = memoryview(self._read_bytes(node))                       # Сжатый файл с конца не прочитать: берем распакованные байты (через кэш)
+        return self._gen_lines_reversed(len(data), self._counted(lambda off, n: data[off:off + n].tobytes()), chunk_size)
+
+    def _counted(self, read_at):                                        # Обертка read_at: все прочитанные блоки идут в декодирование
+        def wrapper(off, n):
+            chunk = read_at(off, n)
+            self.bytes_decoded += len(chunk)
+            return chunk
+        return wrapper
+
+    def _stored_data_offset(self, info: Optional[zipfile.ZipInfo]) -> Optional[int]:   # Смещение данных несжатой (ZIP_STORED) записи в файле архива
+        if (info is None or self._archive is None or not self._archive.filename
+                or info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1):   # 0x1 - зашифрованная запись
+            return None
+        if self._cache.get(info) is not None:                           # Уже распакован - быстрее читать из памяти
+            return None
+        with open(self._archive.filename, "rb") as f:
+            f.seek(info.header_offset)
+            header = f.read(30)                                         # Локальный заголовок: 30 байт, затем имя и extra
+        if len(header) != 30 or header[:4] != b"PK\x03\x04":
+            return None
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        return info.header_offset + 30 + name_len + extra_len
+
+    def _gen_stored_reversed(self, info: zipfile.ZipInfo, start: int, chunk_size: int):
+        with open(self._archive.filename, "rb") as f:                   # Собственный дескриптор: позиция общего ZipFile не сбивается
+            def read_at(off, n):
+                f.seek(start + off)
+                return f.read(n)
+            yield from self._gen_lines_reversed(info.file_size, self._counted(read_at), chunk_size)
+
+    @staticmethod
+    def _gen_lines_reversed(size, read_at, chunk_size):                 # Разбивает данные на строки (\r\n, \r или \n), двигаясь от конца к началу
+        if size == 0:
+            return
+        pos = size
+        last = read_at(size - 1, 1)                                     # Завершающий перевод строки не дает пустой последней строки (как splitlines)
+        if last == b"\n":
+            pos -= 1
+            if pos > 0 and read_at(pos - 1, 1) == b"\r":
+                pos -= 1
+        elif last == b"\r":
+            pos -= 1
+        tail = b""                                                      # Начало строки, которое еще не дочитано из предыдущего блока
+        after_lf = False                                                # Прошлый блок начинался с \n: \r в конце этого блока - та же пара \r\n
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            buf = read_at(start, pos - start) + tail
+            pos = start
+            if after_lf and buf.endswith(b"\r"):                       # tail здесь пуст: \r и \n разошлись по границе блоков
+                buf = buf[:-1]
+            after_lf = pos > 0 and buf.startswith(b"\n")
+            if after_lf:                                                # Перевод строки в начале блока точно есть, а его \r, если он был, в следующем блоке
+                buf = buf[1:]
+            lines = LINE_BREAK.split(buf) if b"\r" in buf else buf.split(b"\n")   # Без \r обычный split заметно быстрее регулярного выражения
+            tail = b"" if after_lf else lines.pop(0)
+            for line in reversed(lines):
+                yield VFS._decode_line(line)
+        yield VFS._decode_line(tail)
+
+    @staticmethod
+    def _decode_line(line: bytes) -> str:
+        return line.decode("utf-8", errors="replace")
     def du_total(self, path):
         abs_path = self._normalize_path(path)
+        if self.table is not None:
+            idx = self.table.lookup(abs_path)
+            if idx < 0:
+                raise FileNotFoundError(f"Путь не найден: {abs_path}")
+            return self.table.size[idx], abs_path
         node = self._get_node(abs_path)
+        return (node.total_size if node.is_dir else node.size), abs_path     # Агрегат уже посчитан - обход поддерева не нужен
 
-        def walk_size(n: VNode):
+    def du_entries(self, path, max_depth: Optional[int] = None, all_files: bool = False):   # Размеры элементов поддерева (как du -a / --max-depth), потомки раньше родителя
+        abs_path = self._normalize_path(path)
+        node = self._get_node(abs_path)
+        if not node.is_dir:
+            yield node.size, abs_path
+            return
+        stack = [(node, abs_path, 0, False)]                            # (узел, путь, глубина, дети уже добавлены)
+        while stack:
+            n, p, depth, expanded = stack.pop()
             if not n.is_dir:
-                return len(n.data)
-            total = 0
-            for child in n.children.values():
-                total += walk_size(child)
-            return total
-        return walk_size(node), abs_path
+                yield n.size, p
+                continue
+            if expanded or (max_depth is not None and depth >= max_depth):
+                yield n.total_size, p
+                continue
+            stack.append((n, p, depth, True))
+            prefix = p.rstrip("/") + "/"
+            for name in sorted(n.children, reverse=True):               # В стек в обратном порядке, чтобы выводить по алфавиту
+                child = n.children[name]
+                if child.is_dir or all_files:
+                    stack.append((child, prefix + name, depth + 1, False))
 
 
     def mkdir(self, path, parents):
         abs_path = self._normalize_path(path)
         if abs_path == "/":
             raise FileExistsError("Корень '/' уже существует")
+        self._thaw()                                                    # Кэш путей не сбрасывается: mkdir только добавляет узлы, а промахи не кэшируются
 
         parts = [p for p in abs_path.strip('/').split('/') if p]
+        self._make_private(parts[:-1])
         parent = self.root
 
         *dirs, last = parts
 
-        for seg in dirs:
+        for i, seg in enumerate(dirs):
             if seg in parent.children:
                 node = parent.children[seg]
                 if not node.is_dir:
@@ -127,8 +899,8 @@ class VFS:                                                                  # Х
                 parent = node
             else:
                 if parents:
-                    parent.children[seg] = VNode(seg, True)
-                    parent = parent.children[seg]
+                    parent = parent.add_dir(seg)
+                    self._added("/" + "/".join(parts[:i + 1]), parent)
                 else:
                     raise FileNotFoundError(f"Путь не найден: /{'/'.join(dirs)}")
         if last in parent.children:
@@ -140,11 +912,223 @@ class VFS:                                                                  # Х
             else:
                 raise FileExistsError(f"Файл уже существует: {abs_path}")
         else:
-            parent.children[last] = VNode(last, True)
+            self._added(abs_path, parent.add_dir(last))
             return abs_path
 
+    def add_file(self, path, data: bytes) -> str:                       # Создает или заменяет файл в существующем каталоге (в архив попадет при sync)
+        abs_path = self._normalize_path(path)
+        if abs_path == "/":
+            raise IsADirectoryError("'/' является директорией")
+        self._thaw()
+        parent_path, _, name = abs_path.rpartition("/")
+        self._make_private([p for p in parent_path.split("/") if p])
+        parent = self._get_node(parent_path or "/")
+        if not parent.is_dir:
+            raise NotADirectoryError(f"'{parent_path}' не является директорией")
+        old = parent.children.get(name)
+        if old is not None and old.is_dir:
+            raise IsADirectoryError(f"'{abs_path}' является директорией")
+        node = parent.add_file([name], data)                            # Агрегаты размеров обновляются вверх по цепочке
+        self._invalidate(abs_path)                                      # В кэше путей мог остаться старый узел
+        self._added(abs_path, node, replaced=old)
+        return abs_path
+
+    def payload_nodes(self) -> List[VNode]:                             # Файлы, чьи данные еще в архиве (для фоновой полной загрузки)
+        if self.table is not None:
+            return []
+        return [n for n, _ in self._walk_tree(self.root, "/") if not n.is_dir and n.zinfo is not None]
+
+    def preload(self, nodes, progress=None, stop: Optional[threading.Event] = None,
+                workers: int = 0, batch_bytes: int = DEFAULT_LOAD_BATCH_BYTES) -> bool:   # Переносит данные файлов в память; вызывается из фонового потока
+        files = [(node, node.zinfo) for node in nodes if node.zinfo is not None]
+        total = len(files)
+        done = loaded = 0
+        batches = self._unpack_batches(files, lambda: open(self.path, "rb"), workers, batch_bytes)   # Свои дескрипторы: основной поток продолжает читать через self._archive
+        try:
+            for batch, datas in batches:
+                if stop is not None and stop.is_set():
+                    return False
+                for (node, _), data in zip(batch, datas):
+                    node.data = data                                    # Сначала данные, потом сброс записи: читатель видит либо запись архива, либо готовые данные
+                    node.zinfo = None
+                    loaded += len(data)
+                done += len(batch)
+                if progress is not None:
+                    progress(done, total, loaded)
+        finally:
+            batches.close()                                             # При остановке пачки, которые пул еще не начал, отменяются
+        return True
+
+    @staticmethod
+    def _path_of(node) -> str:                                          # Абсолютный путь узла по цепочке родителей
+        parts = []
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return "/" + "/".join(reversed(parts))
+
+    def _walk_key(self, node):                                          # Ключ сортировки, дающий порядок _walk_tree: по частям пути (в таблице - каталоги раньше файлов)
+        parts = []
+        dirs_first = self.table is not None
+        while node.parent is not None:
+            parts.append((not node.is_dir, node.name) if dirs_first else node.name)
+            node = node.parent
+        parts.reverse()
+        return parts
+
+    def _walk_tree(self, node, abs_path: str):                          # Обход поддерева в глубину по алфавиту: (узел, путь), начиная с самого узла
+        stack = [(node, abs_path)]
+        while stack:
+            n, p = stack.pop()
+            yield n, p
+            if not n.is_dir:
+                continue
+            prefix = p.rstrip("/") + "/"
+            if self.table is not None:                                  # Дети в таблице уже отсортированы
+                t = self.table
+                stack.extend((TableNode(t, c), prefix + t.name(c)) for c in reversed(t.children(n.idx)))
+            else:
+                stack.extend((n.children[name], prefix + name) for name in sorted(n.children, reverse=True))
+
+    def find(self, path=".", name: Optional[str] = None, kind: Optional[str] = None):   # Пути узлов поддерева с именем по шаблону name и типом kind ("f"/"d")
+        abs_path = self._normalize_path(path)
+        start = self._get_node(abs_path)
+        return self._gen_find(start, abs_path, name, kind)
+
+    def _gen_find(self, start, abs_path, name, kind):
+        def wanted(n):
+            return (kind is None or (kind == "d") == n.is_dir) and (name is None or fnmatch.fnmatchcase(n.name, name))
+
+        if name is None or (self._names is None and abs_path != "/"):   # Без шаблона имени или индекса еще нет - обычный обход поддерева
+            for n, p in self._walk_tree(start, abs_path):
+                if wanted(n):
+                    yield p
+            return
+        if self._names is None:                                         # Первый find от корня: индекс строится тем же обходом, результаты выдаются сразу
+            names: Dict[str, list] = {}
+            for n, p in self._walk_tree(start, abs_path):
+                if n is not start:
+                    names.setdefault(n.name, []).append(n)
+                if wanted(n):
+                    yield p
+            self._names = names                                         # Прерванный обход индекс не оставляет
+            return
+        if any(c in name for c in "*?["):
+            keys = [k for k in self._names if fnmatch.fnmatchcase(k, name)]   # Шаблон сверяется с уникальными именами, а не с каждым узлом
+        else:
+            keys = [name]
+        prefix = abs_path.rstrip("/") + "/"
+        found = []
+        for key in keys:
+            for n in self._names.get(key, ()):
+                if kind is not None and (kind == "d") != n.is_dir:
+                    continue
+                p = self._path_of(n)
+                if abs_path == "/" or p == abs_path or p.startswith(prefix):
+                    found.append(n)
+        found.sort(key=self._walk_key)                                  # Индекс группирует узлы по имени; вывод - в том же порядке, что и обход
+        for n in found:
+            yield self._path_of(n)
+
     @staticmethod
-    def from_zip_file(path: str) -> "VFS":                              # Принимает путь к зип файлу, возвращает новый объект VFS
+    def _char_mask(chars) -> int:                                       # Битовая маска символов: ASCII - по биту на символ, остальные - общий бит 128
+        mask = 0
+        for c in chars:
+            mask |= 1 << min(ord(c), 128)
+        return mask
+
+    def grep(self, pattern: str, path=".", ignore_case: bool = False, files_only: bool = False):   # (путь, номер строки, строка) для совпадений в файлах поддерева
+        regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        literal = pattern if not ignore_case and pattern and not GREP_META.intersection(pattern) else None
+        abs_path = self._normalize_path(path)
+        start = self._get_node(abs_path)
+        return self._gen_grep(start, abs_path, regex, literal, files_only)
+
+    def _gen_grep(self, start, abs_path, regex, literal, files_only):
+        need = self._char_mask(literal) if literal is not None else 0
+        min_size = len(literal.encode("utf-8")) if literal is not None else 0
+        for n, p in self._walk_tree(start, abs_path):
+            if n.is_dir or n.size < min_size:                           # Размер известен из каталога архива: короткий файл не распаковывается
+                continue
+            info = n.zinfo
+            key = info.header_offset if info is not None else n        # Запись архива - по смещению: совпадение CRC и размера не значит одинаковое содержимое
+            mask = self._fingerprints.get(key)
+            if mask is not None and need & ~mask:                       # В файле нет какого-то символа подстроки - совпадений нет
+                continue
+            chars = set()
+            for lineno, line in enumerate(self._gen_lines(n), start=1):
+                if regex.search(line):
+                    yield p, lineno, line
+                    if files_only:                                      # -l: дальше файл не распаковывается
+                        break
+                chars.update(line)
+            else:                                                       # Файл прочитан целиком - запоминаем отпечаток
+                self._fingerprints[key] = self._char_mask(chars)
+
+    def sync(self, target: Optional[str] = None) -> int:               # Дописывает в архив новые записи и новый центральный каталог; возвращает число записей
+        if self._owned is not None:
+            raise PermissionError("sync недоступен в сессии сервера: общий архив только для чтения")
+        target = target or self.path
+        if not target:
+            raise ValueError("Не задан архив для сохранения: sync <file.zip>")
+        save_as = self.path is None or os.path.abspath(target) != os.path.abspath(self.path)
+        entries = []
+        for abs_path, node in self._pending.items():                    # Данные читаются до закрытия архива
+            name = abs_path.lstrip("/")
+            entries.append((name + "/", b"") if node.is_dir else (name, self._read_bytes(node)))
+        if not entries and not save_as:
+            if self.use_index:
+                self.save_index()
+            return 0
+        reopen = type(self._archive) if self._archive is not None else None
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+        if save_as:                                                     # Новый файл: сначала копия исходного архива, затем дописываем
+            if self._raw_zip_bytes is not None:
+                with open(target, "wb") as f:
+                    f.write(self._raw_zip_bytes)
+            else:
+                shutil.copyfile(self.path, target)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")                             # Повтор имени - новая версия записи, при чтении берется последняя
+            with zipfile.ZipFile(target, "a", zipfile.ZIP_DEFLATED) as z:   # Режим "a": старые записи не перепаковываются, пишутся новые и каталог
+                for name, data in entries:
+                    z.writestr(name, data)
+        self.path = target
+        self.name = os.path.basename(target)
+        if reopen is not None:                                          # Смещения старых записей не изменились: их ZipInfo и кэш остаются верными
+            self._archive = reopen(target, "r") if reopen is zipfile.ZipFile else reopen(target)
+        else:
+            with open(target, "rb") as f:
+                self._raw_zip_bytes = f.read()
+        self._pending.clear()
+        if self.use_index:
+            self.save_index()
+        return len(entries)
+
+    def save_index(self):                                               # Записывает файл индекса для быстрого старта
+        table = self.table
+        if table is None:                                               # Дерево VNode: таблицу строим по центральному каталогу архива
+            with zipfile.ZipFile(self.path, "r") as z:
+                table = NodeTable.build(z.infolist())
+        table.save(self.path + INDEX_SUFFIX, os.stat(self.path))
+
+    @staticmethod
+    def from_zip_file(path: str, lazy: bool = False, cache_bytes: int = DEFAULT_CACHE_BYTES, compact: bool = False,
+                      index: bool = False, workers: int = 0, batch_bytes: int = DEFAULT_LOAD_BATCH_BYTES) -> "VFS":                    # Принимает путь к зип файлу, возвращает новый объект VFS
+        if index:                                                       # Режим с индексом тоже ленивый: дерево берется из файла индекса
+            vfs = VFS._mount_index(path, cache_bytes, compact)
+            if vfs is None:                                             # Индекса нет или он устарел: обычное монтирование и запись нового индекса
+                vfs = VFS._mount_lazy(path, cache_bytes, compact)
+                try:
+                    vfs.save_index()
+                except OSError:                                         # Индекс - оптимизация; каталог может быть только для чтения
+                    pass
+            vfs.use_index = True
+            return vfs
+        if lazy or compact:                                             # Компактный режим всегда ленивый: данные читаются из архива
+            return VFS._mount_lazy(path, cache_bytes, compact)
         try:
             with open(path, "rb") as f:                                 # Открываем zip как бинарный файл
                 raw = f.read()                                          # Сырые байты нужны чтобы построить дерево файлов
@@ -153,20 +1137,105 @@ class VFS:                                                                  # Х
         except Exception as e:
             raise RuntimeError(f"Ошибка чтения VFS: {e}") from e
         try:
-            root = VNode("/", True)                                      # Создаем корень дерева
-            with zipfile.ZipFile(io.BytesIO(raw), "r") as z:       # Открываем ZIP из памяти (io.BytesIO создает файлоподобный объект из raw, zipFile открывает его как архив для чтения
-                for info in z.infolist():                                # Обходим все записи архива
-                    p = info.filename                                    # путь внутри архива
-                    if p.endswith("/"):                                  # Если путь заканчивается на /, то это каталог
-                        parts = [x for x in p.strip("/").split("/") if x]# Разбиваем на части
-                        root.ensure_dir(parts)                           # Создаем каталог в дереве
-                    else:                                                # Значит это файл
-                        parts = [x for x in p.split("/") if x]           # Разбиваем на части
-                        data = z.read(info.filename)                     # Читаем содержимое файла
-                        root.add_file(parts, data)                       # Создаем файл и кладем туда байты
+            root = VFS._load_eager(raw, workers, batch_bytes)
         except zipfile.BadZipFile as e:                                  # zip поврежден/невалиден
             raise ValueError("Неверный формат ZIP для VFS") from e
-        return VFS(name=os.path.basename(path), raw_zip_bytes=raw, root=root)   # Создаем объект VFS, оставляем
+        return VFS(name=os.path.basename(path), raw_zip_bytes=raw, root=root, path=path)   # Создаем объект VFS, оставляем
+
+    @staticmethod
+    def _load_eager(raw: bytes, workers: int = 0, batch_bytes: int = DEFAULT_LOAD_BATCH_BYTES) -> VNode:   # Дерево с распакованными данными; workers > 1 - распаковка в пуле потоков
+        root = VNode("/", True)                                          # Создаем корень дерева
+        files = []                                                       # (узел, запись архива) - данные заполняются после построения дерева
+        with zipfile.ZipFile(io.BytesIO(raw), "r") as z:                 # Открываем ZIP из памяти (io.BytesIO создает файлоподобный объект из raw, zipFile открывает его как архив для чтения
+            for info in z.infolist():                                    # Обходим все записи архива
+                p = info.filename                                        # путь внутри архива
+                if p.endswith("/"):                                      # Если путь заканчивается на /, то это каталог
+                    root.ensure_dir([x for x in p.strip("/").split("/") if x])
+                else:                                                    # Значит это файл
+                    node = root.add_file([x for x in p.split("/") if x], propagate=False)
+                    files.append((node, info))
+        for batch, datas in VFS._unpack_batches(files, lambda: io.BytesIO(raw), workers, batch_bytes):   # У каждой задачи свой BytesIO над общими байтами
+            for (node, _), data in zip(batch, datas):
+                node.data = data                                         # Содержимое файла
+        root.recompute_totals()                                          # Агрегаты размеров каталогов считаются один раз
+        return root
+
+    @staticmethod
+    def _unpack_batches(files, opener, workers: int = 0, batch_bytes: int = DEFAULT_LOAD_BATCH_BYTES):   # (пачка, данные) для списка (узел, запись); workers > 1 - распаковка в пуле потоков
+        batches, batch, pending = [], [], 0                              # Записи группируются по объему сжатых данных: мелкие файлы - пачкой, большой - отдельно
+        for item in files:
+            batch.append(item)
+            pending += item[1].compress_size
+            if pending >= batch_bytes:
+                batches.append(batch)
+                batch, pending = [], 0
+        if batch:
+            batches.append(batch)
+
+        def unpack(batch):                                               # opener() дает задаче свой файловый объект: позиции чтения не пересекаются
+            with opener() as f:
+                out = []
+                for _, info in batch:
+                    with open_member(f, info) as stream:
+                        out.append(stream.read())
+                return out
+
+        if workers <= 1 or len(batches) <= 1:
+            for batch in batches:
+                yield batch, unpack(batch)
+            return
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+            futures = [pool.submit(unpack, batch) for batch in batches]
+            try:
+                for batch, future in zip(batches, futures):
+                    yield batch, future.result()
+            finally:
+                for future in futures:                                   # Генератор закрыт раньше времени: не начатые пачки не распаковываются
+                    future.cancel()
+
+    @staticmethod
+    def _mount_index(path: str, cache_bytes: int, compact: bool = False) -> Optional["VFS"]:   # Дерево из файла индекса без разбора ZIP; None - индекс не подходит
+        try:
+            st = os.stat(path)
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"VFS не найдена: {path}") from e
+        table = NodeTable.load(path + INDEX_SUFFIX, st)
+        if table is None:
+            return None
+        archive = IndexedArchive(path)
+        if compact:
+            return VFS(name=os.path.basename(path), raw_zip_bytes=None, root=None, archive=archive, cache_bytes=cache_bytes, table=table, path=path)
+        return VFS(name=os.path.basename(path), raw_zip_bytes=None, root=table.to_vnodes(), archive=archive, cache_bytes=cache_bytes, path=path)
+
+    @staticmethod
+    def _mount_lazy(path: str, cache_bytes: int, compact: bool = False) -> "VFS":   # Строит дерево только по центральному каталогу, данные не читаются
+        try:
+            archive = zipfile.ZipFile(path, "r")                        # ZipFile держит открытый дескриптор файла, архив целиком в память не читается
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"VFS не найдена: {path}") from e
+        except zipfile.BadZipFile as e:
+            raise ValueError("Неверный формат ZIP для VFS") from e
+        except Exception as e:
+            raise RuntimeError(f"Ошибка чтения VFS: {e}") from e
+        try:
+            if compact:
+                table = NodeTable.build(archive.infolist())
+                table.compact_members()
+                archive.close()                                         # ZipFile держит свой infolist; записи читаются по смещениям, как с индексом
+                return VFS(name=os.path.basename(path), raw_zip_bytes=None, root=None, archive=IndexedArchive(path), cache_bytes=cache_bytes,
+                           table=table, path=path)
+            root = VNode("/", True)
+            for info in archive.infolist():
+                p = info.filename
+                if p.endswith("/"):
+                    root.ensure_dir([x for x in p.strip("/").split("/") if x])
+                else:
+                    root.add_file([x for x in p.split("/") if x], zinfo=info, propagate=False)  # Запоминаем только запись архива
+            root.recompute_totals()
+        except Exception:
+            archive.close()
+            raise
+        return VFS(name=os.path.basename(path), raw_zip_bytes=None, root=root, archive=archive, cache_bytes=cache_bytes, path=path)
 
     def default() -> "VFS":
         mem = io.BytesIO()              # Создаем буфер в памяти
@@ -175,72 +1244,479 @@ class VFS:                                                                  # Х
             z.writestr("bin/", "")                          # Добавляем каталог
             z.writestr("etc/", "")                          # Добавляем еще один каталог
         raw = mem.getvalue()                                                    # Берем сырые байты zip
-
-        root = VNode("/", True)
-        with zipfile.ZipFile(io.BytesIO(raw),"r") as z:                   # Открываем ZIP из памяти (io.BytesIO создает файлоподобный объект из raw, zipFile открывает его как архив для чтения
-            for info in z.infolist():                                           # Обходим все записи архива
-                p = info.filename                                               # путь внутри архива
-                if p.endswith("/"):                                             # Если путь заканчивается на /, то это каталог
-                    parts = [x for x in p.strip("/").split("/") if x]           # Разбиваем на части
-                    root.ensure_dir(parts)                                      # Создаем каталог в дереве
-                else:                                                           # Значит это файл
-                    parts = [x for x in p.split("/") if x]                      # Разбиваем на части
-                    data = z.read(info.filename)                                # Читаем содержимое файла
-                    root.add_file(parts, data)                                  # Создаем файл и кладем туда байты
+        root = VFS._load_eager(raw)
         return VFS(name="default.zip", raw_zip_bytes=raw, root=root)            # Создаем объект VFS, оставляем
 
 
 
 
-class EmulatorOs:
-    def __init__(self, vfs_path=None, script_path=None):
-        self.vfs_path = vfs_path
-        self.script_path = script_path
+class CommandStat:                                                          # Счетчики одной команды
+    __slots__ = ("calls", "errors", "total", "samples", "decompressed", "decoded")
 
-        user = getpass.getuser()
-        host = socket.gethostname()
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0                                                    # Суммарное время, с
+        self.samples = deque(maxlen=STATS_SAMPLES)                          # Последние длительности для перцентилей
+        self.decompressed = 0
+        self.decoded = 0
 
-        self.root = tk.Tk()                                                                                         # Создаем окно
-        self.root.configure(bg="black")
-        self.root.title(f'Эмулятор - [{user}@{host}]')                                                              # Заголовок окна
-        self.text = scrolledtext.ScrolledText(self.root, wrap=tk.WORD, state='disabled', height=20, width=80, bg="black", fg="green")
-        # pack - менеджер геометрии (упорядочивает виджеты по пакетам), padx/pady - отступ по гориз./вертикал., fill - как растянуть виджет, expand - доп пространство родителя
-        self.text.pack(padx=6, pady=6, fill=tk.BOTH, expand=True)
+    def p99(self) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
 
-        self.input_var = tk.StringVar()                                                                             # Объект, который хранит строковое значение
-        self.entry = tk.Entry(self.root, textvariable=self.input_var, bg="black", fg="green")                       # Однострочное поле для ввода команд
-        self.entry.bind('<Return>', self.on_enter)                                                                  # При нажатии Enter
-        self.entry.pack(fill=tk.X, padx=6, pady=(0, 6))
-        self.entry.focus()                                                                                          # Курсор сразу в поле ввода
 
-        self.log(f"[debug] vfs = {self.vfs_path}, script = {self.script_path}")                                     # Отладочный вывод параметров
+class CommandStats:                                                         # Статистика выполнения по командам: вызовы, задержки, объем чтения
+    def __init__(self):
+        self.commands: Dict[str, CommandStat] = {}
 
-        self.vfs: Optional[VFS] = None                                                                              # объявляем поле для VFS
-        self._init_vfs(vfs_path)                                                                                    # пробуем загрузить zip или создаем дефолт
+    def record(self, cmd: str, elapsed: float, ok: bool, decompressed: int, decoded: int):
+        st = self.commands.get(cmd)
+        if st is None:
+            st = self.commands[cmd] = CommandStat()
+        st.calls += 1
+        st.errors += not ok
+        st.total += elapsed
+        st.samples.append(elapsed)
+        st.decompressed += decompressed
+        st.decoded += decoded
 
-        if self.script_path:
-            self.run_startup_script(self.script_path)                                                               # Запускаем стартовый скрипт
+    def reset(self):
+        self.commands.clear()
+
+
+class Command:                                                              # Обработчик команды: ядро вызывает run(shell, args) через таблицу COMMANDS
+    name = ""
+    needs_vfs = True                                                        # Без инициализированной VFS команда не выполняется
+    timed = True                                                            # Учитывать в статистике stats
+
+    def run(self, shell: "EmulatorCore", args) -> bool:                     # True - успех, False - ошибка (скрипт останавливается)
+        raise NotImplementedError
+
+
+COMMANDS: Dict[str, Command] = {}                                           # Таблица диспетчеризации: имя команды -> обработчик
+
+
+def register(cls):                                                          # Декоратор: добавляет команду в таблицу
+    COMMANDS[cls.name] = cls()
+    return cls
+
+
+@register
+class LsCommand(Command):
+    name = "ls"
+    usage = "Использование: ls [path] [--limit N] [--offset N]"
+
+    def run(self, shell, args):
+        opts = {"--limit": None, "--offset": 0}
+        paths = []
+        i = 0
+        while i < len(args):
+            a = args[i]
+            key, eq, value = a.partition("=")
+            if key in opts:
+                if not eq:
+                    if i + 1 >= len(args):
+                        shell.log(self.usage)
+                        return False
+                    value = args[i + 1]
+                    i += 1
+                opts[key] = int(value)
+            else:
+                paths.append(a)
+            i += 1
+        limit, offset = opts["--limit"], opts["--offset"]
+        if len(paths) > 1 or offset < 0 or (limit is not None and limit < 0):
+            shell.log(self.usage)
+            return False
+        items, target, total = shell.vfs.ls_page(paths[0] if paths else ".", offset=offset, limit=limit)
+        shell.log(f"Содержимое {target}:")
+        if not total:
+            shell.log("<Пусто>")
+        elif items:
+            shell.log("\n".join(f"{t} {name}" for t, name in items))      # Вся страница - одна запись в вывод
+        shown = offset + len(items)
+        if shown < total:
+            shell.log(f"... показано {len(items)} из {total}, дальше: ls {target} --offset {shown} --limit {limit}")
+        return True
 
-    def _init_vfs(self, vfs_path: Optional[str]):
+
+@register
+class CdCommand(Command):
+    name = "cd"
+
+    def run(self, shell, args):
+        path = args[0] if args else None
+        shell.vfs.cd(path)
+        shell.log(f"Текущая директория: {shell.vfs.cwd}")
+        return True
+
+
+@register
+class TacCommand(Command):
+    name = "tac"
+
+    def run(self, shell, args):
+        if not args:
+            shell.log("Введите аргумент: tac <file>")
+            return False
+        for line in shell.vfs.iter_lines_reversed(args[0]):
+            shell.log(line)
+        return True
+
+
+@register
+class HeadCommand(Command):
+    name = "head"
+
+    def run(self, shell, args):
+        if not args:
+            shell.log("Использование: head [-n N] <file>")
+            return False
+        n = 10
+        file_arg = None
+        if len(args) >= 3 and args[0] == "-n":
+            n = int(args[1])
+            file_arg = args[2]
+        elif len(args) == 2 and args[0].isdigit():
+            n = int(args[0])
+            file_arg = args[1]
+        else:
+            file_arg = args[0]
+        for line in itertools.islice(shell.vfs.iter_lines(file_arg), max(0, n)):   # Распаковка останавливается после n строк
+            shell.log(line)
+        return True
+
+
+@register
+class DuCommand(Command):
+    name = "du"
+    usage = "Использование: du [-a] [-d N|--max-depth N] [path]"
+
+    def run(self, shell, args):
+        all_files = False
+        max_depth = None
+        paths = []
+        i = 0
+        while i < len(args):
+            a = args[i]
+            if a == "-a":
+                all_files = True
+            elif a in ("-d", "--max-depth"):
+                if i + 1 >= len(args):
+                    shell.log(self.usage)
+                    return False
+                max_depth = int(args[i + 1])
+                i += 1
+            elif a.startswith("--max-depth="):
+                max_depth = int(a.split("=", 1)[1])
+            else:
+                paths.append(a)
+            i += 1
+        if max_depth is not None and max_depth < 0:
+            shell.log("Ошибка: глубина не может быть отрицательной")
+            return False
+        path = paths[0] if paths else "."
+        if all_files or max_depth is not None:
+            for size, p in shell.vfs.du_entries(path, max_depth=max_depth, all_files=all_files):
+                shell.log(f"{size} bytes\t{p}")
+        else:
+            total, abs_path = shell.vfs.du_total(path)
+            shell.log(f"{total} bytes\t{abs_path}")
+        return True
+
+
+@register
+class MkdirCommand(Command):
+    name = "mkdir"
+    usage = "Использование: mkdir [-p] <dir> [<dir2> ...]"
+
+    def run(self, shell, args):
+        parents = False
+        paths = []
+        for a in args:
+            if a == "-p":
+                parents = True
+            else:
+                paths.append(a)
+        if not paths:
+            shell.log(self.usage)
+            return False
+        had_errors = False
+        for p in paths:
+            try:
+                created = shell.vfs.mkdir(p, parents=parents)
+                shell.log(f"mkdir: ok: {created}")
+            except Exception as e:
+                shell.log(f"Ошибка: {e}")
+                had_errors = True
+        return not had_errors
+
+
+@register
+class SyncCommand(Command):                                                 # Сохраняет изменения в архив: дописываются только новые записи
+    name = "sync"
+
+    def run(self, shell, args):
+        if len(args) > 1:
+            shell.log("Использование: sync [file.zip]")
+            return False
+        count = shell.vfs.sync(args[0] if args else None)
+        shell.log(f"sync: ok: {shell.vfs.path} (новых записей: {count})")
+        return True
+
+
+@register
+class FindCommand(Command):
+    name = "find"
+    usage = "Использование: find [path] [-name GLOB] [-type f|d]"
+
+    def run(self, shell, args):
+        path, name, kind = ".", None, None
+        i = 0
+        while i < len(args):
+            a = args[i]
+            if a in ("-name", "-type"):
+                if i + 1 >= len(args):
+                    shell.log(self.usage)
+                    return False
+                if a == "-name":
+                    name = args[i + 1]
+                else:
+                    kind = args[i + 1]
+                    if kind not in ("f", "d"):
+                        shell.log(self.usage)
+                        return False
+                i += 1
+            elif i == 0:
+                path = a
+            else:
+                shell.log(self.usage)
+                return False
+            i += 1
+        for p in shell.vfs.find(path, name=name, kind=kind):
+            shell.log(p)
+        return True
+
+
+@register
+class GrepCommand(Command):
+    name = "grep"
+    usage = "Использование: grep [-l] [-i] [-n] <pattern> [path]"
+
+    def run(self, shell, args):
+        flags = set()
+        rest = []
+        for a in args:
+            if a in ("-l", "-i", "-n") and not rest:
+                flags.add(a)
+            else:
+                rest.append(a)
+        if not rest or len(rest) > 2:
+            shell.log(self.usage)
+            return False
+        pattern = rest[0]
+        path = rest[1] if len(rest) > 1 else "."
+        for p, lineno, line in shell.vfs.grep(pattern, path, ignore_case="-i" in flags, files_only="-l" in flags):
+            if "-l" in flags:
+                shell.log(p)
+            elif "-n" in flags:
+                shell.log(f"{p}:{lineno}:{line}")
+            else:
+                shell.log(f"{p}:{line}")
+        return True
+
+
+@register
+class DcacheCommand(Command):                                               # Счетчики кэша путей: помогают подобрать --dcache-size
+    name = "dcache"
+
+    def run(self, shell, args):
+        st = shell.vfs.dcache_stats()
+        shell.log(f"dcache: hits={st['hits']} misses={st['misses']} hit_rate={st['hit_rate']:.1%} entries={st['entries']}/{st['capacity']}")
+        return True
+
+
+@register
+class TimeCommand(Command):                                                 # time <cmd> [args]: время и объем чтения одной команды
+    name = "time"
+    needs_vfs = False
+    timed = False                                                           # Вложенная команда учитывается сама
+
+    def run(self, shell, args):
+        if not args:
+            shell.log("Использование: time <cmd> [args]")
+            return False
+        handler = COMMANDS.get(args[0])
+        if handler is None:
+            shell.log(f"Неизвестная команда: {args[0]}")
+            return False
+        before = shell.read_counters()
+        start = time.perf_counter()
+        ok = shell.run_handler(handler, args[1:])
+        elapsed = time.perf_counter() - start
+        after = shell.read_counters()
+        shell.log(f"time: {elapsed * 1000:.3f} ms, распаковано {after[0] - before[0]} B, декодировано {after[1] - before[1]} B")
+        return ok
+
+
+@register
+class StatsCommand(Command):                                                # Накопленная статистика по командам; stats reset - обнулить
+    name = "stats"
+    needs_vfs = False
+    timed = False
+
+    def run(self, shell, args):
+        if args == ["reset"]:
+            shell.stats.reset()
+            shell.log("stats: сброшено")
+            return True
+        if args:
+            shell.log("Использование: stats [reset]")
+            return False
+        if not shell.stats.commands:
+            shell.log("<Пусто>")
+            return True
+        shell.log(f"{'cmd':<8} {'calls':>7} {'errors':>6} {'total ms':>10} {'avg ms':>9} {'p99 ms':>9} {'unzip B':>12} {'decode B':>12}")
+        for cmd, st in sorted(shell.stats.commands.items(), key=lambda kv: -kv[1].total):   # Самые дорогие сверху
+            shell.log(f"{cmd:<8} {st.calls:>7} {st.errors:>6} {st.total * 1000:>10.3f} {st.total / st.calls * 1000:>9.3f} "
+                      f"{st.p99() * 1000:>9.3f} {st.decompressed:>12} {st.decoded:>12}")
+        return True
+
+
+@register
+class ExitCommand(Command):
+    name = "exit"
+    needs_vfs = False
+
+    def run(self, shell, args):
+        shell.log("Завершение работы...")
+        shell.exit_requested = True
+        shell.on_exit()
+        return True
+
+
+class ScriptOp(NamedTuple):                                                 # Одна разобранная строка скрипта
+    lineno: int                                                             # Номер строки в файле (для сообщений об ошибках)
+    line: str                                                               # Исходный текст (для эха команды)
+    cmd: Optional[str]                                                      # Имя команды; None - строку не удалось разобрать
+    args: List[str]                                                         # Аргументы; при ошибке разбора - [текст ошибки]
+
+
+class ScriptCompiler:                                                       # Разбирает скрипт один раз и кэширует результат на диске
+    CACHE_VERSION = 3                                                       # 2 - JSON вместо pickle; 3 - строки делятся как в текстовом режиме
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        if cache_dir is None:
+            base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            cache_dir = os.path.join(base, "vfs_emulator", "scripts")
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def compile_lines(lines) -> List[ScriptOp]:                            # Текст скрипта -> список операций (пустые строки и комментарии отброшены)
+        ops = []
+        for lineno, raw_line in enumerate(lines, start=1):
+            line = raw_line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                parts = shlex.split(line)
+            except ValueError as e:                                         # Ошибка разбора сохраняется: скрипт остановится на этой строке
+                ops.append(ScriptOp(lineno, line, None, [str(e)]))
+                continue
+            if parts:
+                ops.append(ScriptOp(lineno, line, parts[0], parts[1:]))
+        return ops
+
+    def _cache_file(self, abs_path: str) -> str:
+        key = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def load(self, path: str) -> List[ScriptOp]:                            # Операции скрипта; неизмененный скрипт берется из кэша без разбора
+        abs_path = os.path.abspath(path)
+        with open(abs_path, "rb") as f:
+            raw = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime_ns
+        digest = hashlib.sha256(raw).hexdigest()
+        cache_file = self._cache_file(abs_path)
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if (cached.get("version") == self.CACHE_VERSION and cached.get("path") == abs_path
+                    and cached.get("mtime") == mtime and cached.get("sha256") == digest):
+                return [ScriptOp(*op) for op in cached["ops"]]
+        except Exception:                                                   # Нет кэша или он поврежден - просто разбираем заново
+            pass
+        ops = self.compile_lines(io.StringIO(raw.decode("utf-8"), newline=None))   # Строки - как при чтении файла в текстовом режиме: splitlines делит еще и по \x0c, \x1e, \u2028
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": self.CACHE_VERSION, "path": abs_path, "mtime": mtime, "sha256": digest,
+                           "ops": [list(op) for op in ops]}, f, ensure_ascii=False)
+            os.replace(tmp, cache_file)                                     # Атомарная замена: параллельный запуск не прочитает недописанный файл
+        except OSError:                                                     # Кэш - оптимизация; без него скрипт все равно выполнится
+            pass
+        return ops
+
+
+class EmulatorCore:                                                                                                 # Ядро эмулятора: VFS, разбор и выполнение команд. От GUI не зависит
+    def __init__(self, vfs_path=None, script_path=None, lazy=False, cache_bytes=DEFAULT_CACHE_BYTES, script_cache=True, compact=False,
+                 dcache_size=DEFAULT_DCACHE_SIZE, index=False, load_workers=0, load_batch_bytes=DEFAULT_LOAD_BATCH_BYTES,
+                 profile_path=None):
+        self.vfs_path = vfs_path
+        self.script_path = script_path
+        self.lazy = lazy                                                                                            # Ленивое монтирование архива
+        self.cache_bytes = cache_bytes
+        self.compact = compact                                                                                      # Дерево в компактной таблице (только ленивое чтение)
+        self.dcache_size = dcache_size                                                                              # Размер кэша путей VFS
+        self.index = index                                                                                          # Загружать дерево из файла индекса рядом с архивом
+        self.load_workers = load_workers                                                                            # Потоков распаковки при полной загрузке (0/1 - последовательно)
+        self.load_batch_bytes = load_batch_bytes
+        self.prompt = f"> {getpass.getuser()}@{socket.gethostname()}: "                                             # Приглашение для эха команд
+        self.vfs: Optional[VFS] = None                                                                              # объявляем поле для VFS
+        self.exit_requested = False                                                                                 # Была выполнена команда exit
+        self.script_compiler = ScriptCompiler() if script_cache else None                                           # Кэш разобранных скриптов
+        self.stats = CommandStats()                                                                                 # Счетчики команд для stats
+        self.profile_path = profile_path                                                                            # Куда записать профиль cProfile стартового скрипта
+
+    def _init_vfs(self, vfs_path: Optional[str]) -> bool:
         try:
             if vfs_path:
-                self.vfs = VFS.from_zip_file(vfs_path)                                                              # Грузим зип из диска
-                self.log(f"[VFS] Загружена '{self.vfs.name}'")
+                self._attach_vfs(self._open_vfs(vfs_path))                  # Грузим зип из диска
             else:
                 self.vfs = VFS.default()
+                self.vfs.dcache_size = self.dcache_size
                 self.log("[VFS] Создана дефолтная VFS")
-        except FileNotFoundError as e:
-            self.log(f"[Ошибка] {e}")
-        except ValueError as e:
-            self.log(f"[Ошибка] {e}")
+            return True
         except Exception as e:
-            self.log(f"[Ошибка] Не удалось инициализировать VFS: {e}")
+            self.log(self._vfs_error(e))
+        return False
 
-    def log(self, msg):                                                     # Вывод текста
-        self.text.configure(state='normal')                                 # Доступный для записи
-        self.text.insert(tk.END, msg + "\n")                                # Перенос строки в конце сообщения
-        self.text.see(tk.END)                                               # Прокручиваем вниз
-        self.text.configure(state='disabled')
+    def _open_vfs(self, vfs_path: str, lazy: Optional[bool] = None) -> VFS:   # Загрузка без вывода: может выполняться в фоновом потоке
+        return VFS.from_zip_file(vfs_path, lazy=self.lazy if lazy is None else lazy, cache_bytes=self.cache_bytes, compact=self.compact,
+                                 index=self.index, workers=self.load_workers, batch_bytes=self.load_batch_bytes)
+
+    def _attach_vfs(self, vfs: VFS, mode: Optional[str] = None):
+        self.vfs = vfs
+        vfs.dcache_size = self.dcache_size
+        if mode is None:
+            mode = " (компактный режим)" if self.compact else " (ленивый режим)" if self.lazy or self.index else ""
+        self.log(f"[VFS] Загружена '{vfs.name}'{mode}")
+
+    @staticmethod
+    def _vfs_error(e: Exception) -> str:
+        if isinstance(e, (FileNotFoundError, ValueError)):
+            return f"[Ошибка] {e}"
+        return f"[Ошибка] Не удалось инициализировать VFS: {e}"
+
+    def log(self, msg):                                                     # Вывод текста; реализуется интерфейсом (GUI или stdout)
+        raise NotImplementedError
+
+    def on_exit(self):                                                      # Реакция интерфейса на команду exit
+        pass
 
     def parse_cmd(self, line):                                              # Парсер команд
         try:
@@ -253,125 +1729,212 @@ class EmulatorOs:
             return None, []
 
     def execute(self, cmd, args):
-        if cmd == "ls":
-            if not self.vfs:
-                self.log("VFS не инициализирована")
-                return False
-            try:
-                path = args[0] if args else "."
-                items, target = self.vfs.ls(path)
-                self.log(f"Содержимое {target}:")
-                if not items:
-                    self.log("<Пусто>")
-                else:
-                    for t, name in items:
-                        self.log(f"{t} {name}")
-                return True
-            except Exception as e:
-                self.log(f"Ошибка: {e}")
-                return False
-        elif cmd == "cd":
-            if not self.vfs:
-                self.log("VFS не инициализирована")
-                return False
-            try:
-                path = args[0] if args else None
-                self.vfs.cd(path)
-                self.log(f"Текущая директория: {self.vfs.cwd}")
-                return True
-            except Exception as e:
-                self.log(f"Ошибка: {e}")
-                return False
-        elif cmd == "tac":
-            if not self.vfs:
-                self.log("VFS не инициализирована")
-                return False
-            if not args:
-                self.log("Введите аргумент: tac <file>")
-                return False
-            try:
-                text = self.vfs.read_text(args[0])
-                lines = text.splitlines()
-                for line in reversed(lines):
-                    self.log(line)
-                return True
-            except Exception as e:
-                self.log(f"Ошибка: {e}")
-                return False
-        elif cmd == "head":
-            if not self.vfs:
-                self.log("VFS не инициализирована")
-                return False
-            if not args:
-                self.log("Использование: head [-n N] <file>")
-                return False
-            try:
-                n = 10
-                file_arg = None
-                if len(args) >= 3 and args[0] == "-n":
-                    n = int(args[1])
-                    file_arg = args[2]
-                elif len(args) == 2 and args[0].isdigit():
-                    n = int(args[0])
-                    file_arg = args[1]
-                else:
-                    file_arg = args[0]
-                text = self.vfs.read_text(file_arg)
-                for line in text.splitlines()[: max(0, n)]:
-                    self.log(line)
-                return True
-            except Exception as e:
-                self.log(f"Ошибка: {e}")
-                return False
-        elif cmd == "du":
-            if not self.vfs:
-                self.log("VFS не инициализирована")
-                return False
-            try:
-                path = args[0] if args else "."
-                total, abs_path = self.vfs.du_total(path)
-                self.log(f"{total} bytes\t{abs_path}")
-                return True
-            except Exception as e:
-                self.log(f"Ошибка: {e}")
-                return False
-        elif cmd == "mkdir":
-            if not self.vfs:
-                self.log("VFS не инициализирована")
-                return False
-            if not args:
-                self.log("Использование: mkdir [-p] <dir> [<dir2> ...]")
+        handler = COMMANDS.get(cmd)                                         # Поиск обработчика в таблице вместо цепочки if/elif
+        if handler is None:
+            self.log(f"Неизвестная команда: {cmd}")
+            return False
+        return self.run_handler(handler, args)
+
+    def run_handler(self, handler: Command, args) -> bool:
+        if handler.needs_vfs and not self.vfs:
+            self.log("VFS не инициализирована")
+            return False
+        if not handler.timed:
+            return self._run_safe(handler, args)
+        before = self.read_counters()
+        start = time.perf_counter()
+        ok = self._run_safe(handler, args)
+        elapsed = time.perf_counter() - start
+        after = self.read_counters()
+        self.stats.record(handler.name, elapsed, ok, after[0] - before[0], after[1] - before[1])
+        return ok
+
+    def _run_safe(self, handler: Command, args) -> bool:
+        try:
+            return handler.run(self, args)
+        except Exception as e:
+            self.log(f"Ошибка: {e}")
+            return False
+
+    def read_counters(self):                                                # (распаковано, декодировано) байт на текущий момент
+        if self.vfs is None:
+            return 0, 0
+        return self.vfs.bytes_decompressed, self.vfs.bytes_decoded
+
+    def run_startup_script(self, path) -> bool:                            # Выполняет скрипт до первой ошибки; True - все команды успешны
+        try:
+            if self.script_compiler is not None:
+                ops = self.script_compiler.load(path)                       # Разобранный скрипт из кэша, если файл не менялся
+            else:
+                with open(path, "r", encoding="utf-8") as f:                # with сам закроет файл, "r" - режим чтения
+                    ops = ScriptCompiler.compile_lines(f)
+        except FileNotFoundError:
+            self.log(f"[Ошибка] Стартовый скрипт '{path}' не найден.")
+            return False
+        except Exception as e:
+            self.log(f"[Ошибка] При чтении скрипта возникла ошибка: {e}")
+            return False
+        if not self.profile_path:
+            return self.run_ops(ops)
+        import cProfile                                                     # Импорт здесь: без --profile модуль не нужен
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.run_ops, ops)
+        finally:
+            profiler.dump_stats(self.profile_path)                          # Формат pstats: python -m pstats <file>
+            self.log(f"[profile] Профиль записан в '{self.profile_path}'")
+
+    def run_script_lines(self, lines) -> bool:
+        return self.run_ops(ScriptCompiler.compile_lines(lines))
+
+    def run_ops(self, ops) -> bool:
+        for op in ops:
+            self.log(self.prompt + op.line)                                 # Имитация ввода пользователя
+            if op.cmd is None:
+                self.log(f"Ошибка парсинга аргументов: {op.args[0]}")
+                self.log(f"[Ошибка в строке {op.lineno}] Парсинг команды не удался.")
                 return False
-            try:
-                parents = False
-                paths = []
-                for a in args:
-                    if a == "-p":
-                        parents = True
-                    else:
-                        paths.append(a)
-                if not paths:
-                    self.log("Использование: mkdir [-p] <dir> [<dir2> ...]")
-                    return False
-                had_errors = False
-                for p in paths:
-                    try:
-                        created = self.vfs.mkdir(p, parents=parents)
-                        self.log(f"mkdir: ok: {created}")
-                    except Exception as e:
-                        self.log(f"Ошибка: {e}")
-                        had_errors = True
-                return not had_errors
-            except Exception as e:
-                self.log(f"Ошибка: {e}")
+            ok = self.execute(op.cmd, op.args)
+            if not ok:
+                self.log(f"[Ошибка в строке {op.lineno}] Команда '{op.cmd}' завершилась ошибкой.")
                 return False
-        elif cmd == "exit":
-            self.log("Завершение работы...")
-            self.root.quit()
-            return True
+            if self.exit_requested:
+                break
+        return True
+
+
+class EmulatorOs(EmulatorCore):                                                                                     # Графический интерфейс (Tkinter) поверх ядра
+    FLUSH_INTERVAL_MS = 30                                                                                          # Как часто очередь вывода сбрасывается в виджет
+    LOADER_POLL_MS = 50                                                                                             # Как часто окно забирает сообщения фонового загрузчика
+    PROGRESS_INTERVAL_S = 0.5                                                                                       # Как часто загрузчик сообщает о прогрессе
+
+    def __init__(self, scrollback=DEFAULT_SCROLLBACK, **options):                                                   # options - параметры ядра (vfs_path, script_path, lazy, ...)
+        import tkinter as tk                                                                                        # Импорт здесь: headless-режиму Tk не нужен
+        from tkinter import scrolledtext                                                                            # виджет текстового поля с полосой прокуртки
+        super().__init__(**options)
+        self.scrollback = scrollback                                                                                # Лимит строк в окне (0 - без ограничения)
+        self._pending = deque(maxlen=scrollback or None)                                                            # Очередь строк до следующего сброса; старше лимита все равно не покажутся
+        self._pending_overflow = False                                                                              # Очередь переполнилась: старое содержимое окна устарело целиком
+        self._flush_scheduled = False
+        self._loading = False                                                                                       # VFS еще загружается в фоне
+        self._deferred = []                                                                                         # Команды, введенные до готовности дерева
+        self._loader_queue = queue.Queue()                                                                          # (вид, данные) от фонового потока
+        self._loader_stop = threading.Event()
+
+        user = getpass.getuser()
+        host = socket.gethostname()
+
+        self.root = tk.Tk()                                                                                         # Создаем окно
+        self.root.configure(bg="black")
+        self.root.title(f'Эмулятор - [{user}@{host}]')                                                              # Заголовок окна
+        self.text = scrolledtext.ScrolledText(self.root, wrap=tk.WORD, state='disabled', height=20, width=80, bg="black", fg="green")
+        # pack - менеджер геометрии (упорядочивает виджеты по пакетам), padx/pady - отступ по гориз./вертикал., fill - как растянуть виджет, expand - доп пространство родителя
+        self.text.pack(padx=6, pady=6, fill=tk.BOTH, expand=True)
+
+        self.input_var = tk.StringVar()                                                                             # Объект, который хранит строковое значение
+        self.entry = tk.Entry(self.root, textvariable=self.input_var, bg="black", fg="green")                       # Однострочное поле для ввода команд
+        self.entry.bind('<Return>', self.on_enter)                                                                  # При нажатии Enter
+        self.entry.pack(fill=tk.X, padx=6, pady=(0, 6))
+        self.entry.focus()                                                                                          # Курсор сразу в поле ввода
+
+        self.log(f"[debug] vfs = {self.vfs_path}, script = {self.script_path}")                                     # Отладочный вывод параметров
+
+        if self.vfs_path:                                                                                           # Архив грузится в фоне: окно отвечает сразу
+            self._loading = True
+            threading.Thread(target=self._load_worker, daemon=True).start()
+            self.root.after(self.LOADER_POLL_MS, self._poll_loader)
         else:
-            self.log(f"Неизвестная команда: {cmd}")
-            return False
+            self._init_vfs(None)                                                                                    # Дефолтная VFS создается мгновенно
+            self._after_load()
+
+    def _load_worker(self):                                                 # Фоновый поток: Tk не трогает, все сообщения идут через очередь
+        post = self._loader_queue.put
+        eager = not (self.lazy or self.compact or self.index)
+        try:
+            vfs = self._open_vfs(self.vfs_path, lazy=True)                  # Сначала только дерево по центральному каталогу, данные остаются в архиве
+            nodes = vfs.payload_nodes() if eager else []                    # Список снимается до передачи VFS в окно: дальше дерево может меняться (mkdir)
+        except Exception as e:
+            post(("error", self._vfs_error(e)))
+            return
+        post(("ready", vfs, " (данные распаковываются в фоне)" if nodes else None))
+        last = 0.0
+
+        def progress(done, total, size):
+            nonlocal last
+            now = time.monotonic()
+            if done == total or now - last >= self.PROGRESS_INTERVAL_S:
+                last = now
+                post(("log", f"[VFS] Распаковано файлов: {done}/{total} ({size // 1024} КБ)"))
+
+        try:
+            if nodes:
+                vfs.preload(nodes, progress, self._loader_stop,             # Нераспакованные файлы тем временем читаются из архива по требованию
+                            workers=self.load_workers, batch_bytes=self.load_batch_bytes)
+        except Exception as e:
+            post(("log", f"[Ошибка] Фоновая распаковка остановлена: {e}"))
+        post(("done",))
+
+    def _poll_loader(self):                                                 # Выполняется в потоке Tk
+        while True:
+            try:
+                msg = self._loader_queue.get_nowait()
+            except queue.Empty:
+                break
+            kind = msg[0]
+            if kind == "log":
+                self.log(msg[1])
+            elif kind == "ready":
+                self._loading = False
+                self._attach_vfs(msg[1], msg[2])
+                self._after_load()                                          # Скрипту нужно дерево, а не распакованные данные
+            elif kind == "error":
+                self._loading = False
+                self.log(msg[1])
+                self._after_load()                                          # Как и раньше: без VFS команды скрипта завершатся ошибкой
+                return
+            elif kind == "done":
+                return
+        self.root.after(self.LOADER_POLL_MS, self._poll_loader)
+
+    def _after_load(self):                                                  # Стартовый скрипт, затем команды, введенные во время загрузки
+        if self.script_path:
+            self.run_startup_script(self.script_path)                                                               # Запускаем стартовый скрипт
+        deferred, self._deferred = self._deferred, []
+        for cmd, args in deferred:
+            if self.exit_requested:
+                break
+            self.execute(cmd, args)
+
+    def log(self, msg):                                                     # Вывод текста: строка ставится в очередь, виджет обновляется по таймеру
+        if self._pending.maxlen is not None and len(self._pending) == self._pending.maxlen:
+            self._pending_overflow = True
+        self._pending.append(msg)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.root.after(self.FLUSH_INTERVAL_MS, self._flush_output)
+
+    def _flush_output(self):                                                # Одна вставка и одна прокрутка на всю накопленную пачку
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        chunk = "\n".join(self._pending) + "\n"
+        self._pending.clear()
+        self.text.configure(state='normal')                                 # Доступный для записи
+        if self._pending_overflow:
+            self.text.delete("1.0", "end")
+            self._pending_overflow = False
+        self.text.insert("end", chunk)
+        if self.scrollback:
+            lines = int(self.text.index("end-1c").split(".")[0]) - 1        # Число полных строк в виджете
+            excess = lines - self.scrollback
+            if excess > 0:
+                self.text.delete("1.0", f"{excess + 1}.0")                 # Отрезаем самые старые строки
+        self.text.see("end")                                                # Прокручиваем вниз
+        self.text.configure(state='disabled')
+
+    def on_exit(self):
+        self._loader_stop.set()                                             # Фоновая распаковка больше не нужна
+        self.root.quit()
 
     def run(self):
         self.root.mainloop()
@@ -382,41 +1945,217 @@ class EmulatorOs:
         if not line:
             return
 
-        self.log(f"> {getpass.getuser()}@{socket.gethostname()}: {line}")                                               # Печатаем строку
+        self.log(self.prompt + line)                                        # Печатаем строку
 
         cmd, args = self.parse_cmd(line)
         if cmd:
+            handler = COMMANDS.get(cmd)
+            if self._loading and (handler is None or handler.needs_vfs):
+                self._deferred.append((cmd, args))
+                self.log("[VFS] Дерево еще загружается: команда выполнится после загрузки")
+                return
             self.execute(cmd, args)
 
-    def run_startup_script(self, path):
+
+class HeadlessEmulator(EmulatorCore):                                       # Пакетный режим без GUI: вывод в буферизованный stdout, результат - код возврата
+    FLUSH_LINES = 4096                                                      # Сколько строк копить перед записью в поток
+
+    def __init__(self, stream=None, **options):
+        super().__init__(**options)
+        self.stream = stream if stream is not None else sys.stdout
+        self._pending = []                                                  # Строки, еще не записанные в поток
+
+    def log(self, msg):
+        self._pending.append(msg)
+        if len(self._pending) >= self.FLUSH_LINES:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.stream.write("\n".join(self._pending) + "\n")           # Одна запись на пачку строк
+            self._pending.clear()
+        self.stream.flush()
+
+    def run(self) -> int:                                                   # 0 - успех, 1 - ошибка команды, 2 - ошибка VFS или скрипта
         try:
-            with open(path, "r", encoding="utf-8") as f:                # with сам закроет файл, "r" - режим чтения
-                for lineno, raw_line in enumerate(f, start=1):
-                    line = raw_line.strip()
-                    if not line or line.startswith("#"):
-                        continue
-                    self.log(f"> {getpass.getuser()}@{socket.gethostname()}: {line}")                               # Имитация ввода пользователя
-                    cmd, args = self.parse_cmd(line)
-                    if not cmd:
-                        self.log(f"[Ошибка в строке {lineno}] Парсинг команды не удался.")
-                        break
-                    ok = self.execute(cmd, args)
-                    if not ok:
-                        self.log(f"[Ошибка в строке {lineno}] Команда '{cmd}' завершилась ошибкой.")
-                        break
-        except FileNotFoundError:
-            self.log(f"[Ошибка] Стартовый скрипт '{path}' не найден.")
-        except Exception as e:
-            self.log(f"[Ошибка] При чтении скрипта возникла ошибка: {e}")
+            if not self._init_vfs(self.vfs_path):
+                return 2
+            if self.script_path:
+                if not os.path.isfile(self.script_path):
+                    self.log(f"[Ошибка] Стартовый скрипт '{self.script_path}' не найден.")
+                    return 2
+                ok = self.run_startup_script(self.script_path)
+            else:
+                ok = self.run_script_lines(sys.stdin)                       # Без --script команды читаются из stdin
+            return 0 if ok else 1
+        finally:
+            self.flush()
+
+
+class SessionEmulator(EmulatorCore):                                        # Одна сессия сервера: свой cwd и изменения поверх общей VFS, вывод - пачками в сокет
+    def __init__(self, vfs: VFS, loop: asyncio.AbstractEventLoop, **options):
+        super().__init__(**options)
+        self.vfs = vfs
+        self.loop = loop
+        self.chunks: "asyncio.Queue[tuple]" = asyncio.Queue()               # (пачка вывода, последняя ли) для цикла событий
+        self.closed = False                                                 # Клиент отключился: вывод отбрасывается, команда доходит до конца
+        self._slots = threading.Semaphore(SERVER_CHUNKS_IN_FLIGHT)          # Свободные места под пачки: их возвращает цикл событий после отправки
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+
+    def log(self, msg):                                                     # Вызывается в потоке пула
+        if self.closed:
+            return
+        text = str(msg)
+        if SERVER_END in text:                                              # Данные не должны выглядеть как терминатор: ведущий "\x1e" удваивается
+            text = "\n".join(SERVER_END + part if part.startswith(SERVER_END) else part for part in text.split("\n"))
+        self._write(text)
+
+    def _write(self, text: str):
+        line = f"{text}\n".encode("utf-8")
+        self._buffer.append(line)
+        self._buffered += len(line)
+        if self._buffered >= SERVER_CHUNK_BYTES:
+            self._send(final=False)
+
+    def _send(self, final: bool):                                           # Передает накопленный вывод циклу событий; ждет, если клиент не успевает читать
+        chunk = b"".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        if not final:                                                       # Последней пачке место не нужно: команда после нее уже не пишет
+            self._slots.acquire()
+        if self.closed:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.chunks.put_nowait, (chunk, final))
+        except RuntimeError:                                                # Цикл событий уже остановлен (сервер завершается)
+            self.closed = True
+
+    def sent(self):                                                         # Цикл событий отправил пачку: место освобождается
+        self._slots.release()
+
+    def close(self):                                                        # Клиент отключился: будим команду, если она ждет места под пачку
+        self.closed = True
+        for _ in range(SERVER_CHUNKS_IN_FLIGHT):
+            self._slots.release()
+
+    def run_line(self, line: str) -> bool:
+        cmd, args = self.parse_cmd(line)
+        if cmd is None:
+            return not line.strip()                                         # Пустая строка - не ошибка, ошибка разбора - ошибка
+        return self.execute(cmd, args)
+
+    def respond(self, line: str):                                           # В потоке пула: выполняет строку и отправляет вывод с терминатором последней пачкой
+        ok = False
+        try:
+            ok = self.run_line(line)
+        except Exception as e:                                              # Ошибки команд ловит execute; сюда доходят только сбои разбора
+            self.log(f"Ошибка: {e}")
+        finally:
+            self._write(f"{SERVER_END}{0 if ok else 1}")                    # Терминатор - мимо экранирования log
+            self._send(final=True)
+
+
+class EmulatorServer:                                                       # Много сессий над одной VFS: дерево загружается один раз, каждая сессия пишет в свою копию
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_SERVER_PORT, stream=None, workers: int = DEFAULT_SERVER_WORKERS, **options):
+        self.host = host
+        self.port = port
+        self.workers = workers                                              # Сколько команд разных сессий выполняется одновременно
+        self.options = options                                              # Параметры ядра (vfs_path, lazy, dcache_size, ...)
+        self.stream = stream if stream is not None else sys.stdout
+        self.base: Optional[VFS] = None                                     # Общее дерево; сессии получают его через fork()
+        self.sessions = 0                                                   # Сколько сессий открыто сейчас
+        self.pool: Optional[ThreadPoolExecutor] = None                      # Создается в serve()
+
+    def run(self) -> int:                                                   # 0 - сервер остановлен, 2 - VFS не загрузилась
+        boot = HeadlessEmulator(stream=self.stream, **self.options)
+        if not boot._init_vfs(self.options.get("vfs_path")):
+            boot.flush()
+            return 2
+        boot.flush()
+        self.base = boot.vfs
+        self.base._thaw()                                                   # Компактная таблица переводится в VNode один раз, до первой сессии
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    async def serve(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)           # Команды - в пуле: долгая команда одной сессии не держит цикл событий
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        port = server.sockets[0].getsockname()[1]                           # При --serve 0 порт выбирает система
+        self.stream.write(f"[server] Слушаю {self.host}:{port}\n")
+        self.stream.flush()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(wait=False)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):   # Протокол: строка команды -> строки вывода и терминатор SERVER_END + код
+        loop = asyncio.get_running_loop()
+        session = SessionEmulator(self.base.fork(), loop, **self.options)
+        self.sessions += 1
+        try:
+            while not session.exit_requested:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", errors="replace").strip()
+                self.pool.submit(session.respond, line)                     # Дерево меняют только копии сессии, общие узлы только читаются
+                final = False
+                while not final:                                            # Вывод уходит по мере выполнения, в памяти - не больше SERVER_CHUNKS_IN_FLIGHT пачек
+                    chunk, final = await session.chunks.get()
+                    writer.write(chunk)
+                    await writer.drain()
+                    if not final:
+                        session.sent()
+        except ConnectionError:
+            pass
+        finally:
+            session.close()
+            self.sessions -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
 
 
 def main():
     parser = argparse.ArgumentParser(description="Stage 5")
     parser.add_argument("--vfs", help="Путь к ZIP-файлу виртуальной ФС", default=None)
     parser.add_argument("--script", help="Путь к стартовому скрипту", default=None)
+    parser.add_argument("--lazy", action="store_true", help="Ленивое монтирование: файлы распаковываются при первом чтении")
+    parser.add_argument("--compact", action="store_true", help="Хранить дерево в компактной таблице (меньше памяти на огромных архивах; подразумевает --lazy)")
+    parser.add_argument("--index", action="store_true", help="Загружать дерево из файла индекса <vfs>.idx (создается при первом запуске и при sync; подразумевает --lazy)")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024), help="Размер кэша распакованных файлов в МБ (ленивый режим)")
+    parser.add_argument("--load-workers", type=int, default=0, help="Потоков для распаковки архива при полной загрузке (0 - последовательно)")
+    parser.add_argument("--load-batch-kb", type=int, default=DEFAULT_LOAD_BATCH_BYTES // 1024, help="Сколько КБ сжатых данных распаковывает одна задача пула")
+    parser.add_argument("--headless", action="store_true", help="Выполнить скрипт (или команды из stdin) без GUI и выйти с кодом возврата")
+    parser.add_argument("--serve", type=int, nargs="?", const=DEFAULT_SERVER_PORT, default=None, metavar="PORT",
+                        help=f"Сервер сессий на локальном сокете (порт по умолчанию {DEFAULT_SERVER_PORT}, 0 - выбрать свободный)")
+    parser.add_argument("--host", default="127.0.0.1", help="Адрес сервера сессий")
+    parser.add_argument("--dcache-size", type=int, default=DEFAULT_DCACHE_SIZE, help="Сколько разрешенных путей помнит кэш VFS (0 - выключен)")
+    parser.add_argument("--profile", default=None, metavar="FILE", help="Выполнить --script под cProfile и записать профиль в FILE")
+    parser.add_argument("--no-script-cache", action="store_true", help="Не использовать кэш разобранных скриптов")
+    parser.add_argument("--scrollback", type=int, default=DEFAULT_SCROLLBACK, help="Сколько последних строк хранит окно вывода (0 - без ограничения)")
     args = parser.parse_args()
+    if args.profile and not args.script:
+        parser.error("--profile требует --script")
 
-    app = EmulatorOs(vfs_path=args.vfs, script_path=args.script)
+    options = dict(vfs_path=args.vfs, script_path=args.script, lazy=args.lazy, cache_bytes=args.cache_mb * 1024 * 1024,
+                   script_cache=not args.no_script_cache, compact=args.compact, dcache_size=max(0, args.dcache_size),
+                   index=args.index, load_workers=max(0, args.load_workers), load_batch_bytes=max(1, args.load_batch_kb) * 1024,
+                   profile_path=args.profile)
+    if args.serve is not None:
+        options.pop("script_path")                                          # Команды приходят от клиентов
+        options.pop("profile_path")
+        sys.exit(EmulatorServer(host=args.host, port=args.serve, **options).run())
+    if args.headless:
+        sys.exit(HeadlessEmulator(**options).run())
+    app = EmulatorOs(scrollback=max(0, args.scrollback), **options)
     app.run()
 
 if __name__ == "__main__":      # Чтобы при импорте программа не запустилась автоматически
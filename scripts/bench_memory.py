@@ -0,0 +1,114 @@
+"""Сравнение памяти под дерево VFS: старый @dataclass VNode, VNode со __slots__ и NodeTable.
+
+Запуск: python scripts/bench_memory.py [--entries 1000000] [--zip путь]
+Архив генерируется один раз (пустые файлы в 1000 каталогах), затем каждое
+представление строится по уже прочитанному центральному каталогу и измеряется
+tracemalloc'ом. Память самого infolist здесь не учитывается и выводится отдельно.
+Вторая часть - итог по режимам монтирования: все, что VFS держит после загрузки
+(дерево, записи архива, открытый ZipFile со своим infolist).
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from dataclasses import dataclass, field
+from typing import Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from main import VFS, NodeTable, VNode                                      # noqa: E402
+
+
+@dataclass
+class LegacyVNode:                                                          # VNode в том виде, в каком он был до перехода на __slots__
+    name: str
+    is_dir: bool
+    children: Dict[str, "LegacyVNode"] = field(default_factory=dict)
+    data: bytes = b""
+
+    def ensure_dir(self, parts):
+        node = self
+        for p in parts:
+            if p not in node.children:
+                node.children[p] = LegacyVNode(p, True)
+            node = node.children[p]
+        return node
+
+    def add_file(self, parts, data: bytes):
+        *dirs, filename = parts
+        parent = self.ensure_dir(dirs)
+        parent.children[filename] = LegacyVNode(filename, False, data=data)
+
+
+def make_archive(path, entries, dirs=1000):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as z:
+        for i in range(entries):
+            z.writestr(f"d{i % dirs}/file{i}.txt", b"")
+
+
+def build_legacy(infos):
+    root = LegacyVNode("/", True)
+    for info in infos:
+        root.add_file([x for x in info.filename.split("/") if x], b"")
+    return root
+
+
+def build_slots(infos):
+    root = VNode("/", True)
+    for info in infos:
+        root.add_file([x for x in info.filename.split("/") if x], zinfo=info, propagate=False)
+    root.recompute_totals()
+    return root
+
+
+def measure(label, fn, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    obj = fn(*args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} {current / 2**20:9.1f} МБ  (пик {peak / 2**20:9.1f} МБ, {elapsed:6.1f} с)")
+    del obj
+    gc.collect()
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память дерева VFS на синтетическом архиве")
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--zip", default=None, help="Готовый архив (иначе генерируется во временном каталоге)")
+    args = parser.parse_args()
+
+    path = args.zip
+    tmp = None
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, "synthetic.zip")
+        print(f"Генерация архива на {args.entries} записей...")
+        make_archive(path, args.entries)
+    try:
+        with zipfile.ZipFile(path) as z:
+            infos = z.infolist()
+            print(f"Записей: {len(infos)}")
+            measure("infolist (общий)", lambda: zipfile.ZipFile(path).infolist())
+            measure("@dataclass VNode", build_legacy, infos)
+            measure("VNode + __slots__", build_slots, infos)
+            measure("NodeTable", NodeTable.build, infos)
+        del infos
+        print("Итого на режим (дерево + записи архива + открытый архив):")
+        measure("--lazy", lambda: VFS.from_zip_file(path, lazy=True))
+        measure("--compact", lambda: VFS.from_zip_file(path, compact=True))
+        VFS.from_zip_file(path, compact=True, index=True).close()           # Первый запуск с --index пишет файл индекса рядом с архивом
+        measure("--compact --index", lambda: VFS.from_zip_file(path, compact=True, index=True))
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
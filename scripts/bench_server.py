@@ -0,0 +1,173 @@
+"""Пропускная способность и задержки сервера сессий (main.py --serve).
+
+Запуск: python scripts/bench_server.py [--clients 50] [--requests 200] [--scale 0.2] [--tac-mb 0] [--out bench_server.json]
+
+Генерирует архив из мелких файлов (как сценарий small в bench_vfs.py), поднимает
+сервер на свободном порту и открывает --clients одновременных сессий. Каждая
+сессия выполняет --requests команд (cd, ls --limit, head, tac, du, mkdir -p в
+своем оверлее). Замеряется задержка каждого запроса (от отправки строки до
+терминатора ответа), общая пропускная способность и пиковый RSS сервера
+(VmHWM из /proc, только Linux). С --tac-mb в архив добавляется несжатый файл
+такого размера, и отдельная сессия все время замера выполняет на нем tac:
+видно, как долгая команда с большим выводом влияет на остальных. Ее запросы
+в задержки не входят. Результаты пишутся в JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from main import SERVER_END                                                 # noqa: E402
+from bench_vfs import LINE, gen_small                                       # noqa: E402
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main.py")
+END = SERVER_END.encode()
+
+
+def is_end(reply):                                                          # Терминатор ответа; строка вывода с "\x1e" в начале приходит с удвоенным "\x1e"
+    return reply.startswith(END) and not reply.startswith(END * 2)
+
+
+def commands(client, count, targets):                                      # Смесь чтений и записей; mkdir каждой сессии попадает только в ее оверлей
+    cycle = [f"cd {targets['dir']}", "ls --limit 20", f"head -n 5 {targets['file']}", f"tac {targets['file']}", "du /",
+             "cd /", f"mkdir -p /s{client}/d{{i}}", "ls /"]
+    return [cycle[i % len(cycle)].replace("{i}", str(i)) for i in range(count)]
+
+
+async def client(port, lines, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    errors = 0
+    try:
+        for line in lines:
+            start = time.perf_counter()
+            writer.write(line.encode("utf-8") + b"\n")
+            await writer.drain()
+            while True:
+                reply = await reader.readline()
+                if not reply:
+                    raise ConnectionError("Сервер закрыл соединение")
+                if is_end(reply):
+                    errors += reply.strip() != END + b"0"
+                    break
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return errors
+
+
+async def heavy_client(port, stop):                                         # Пока идет замер, гоняет tac по большому файлу и читает ответ целиком
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    runs = 0
+    try:
+        while not stop.is_set():
+            writer.write(b"tac /big.log\n")
+            await writer.drain()
+            while True:
+                reply = await reader.readline()
+                if not reply:
+                    raise ConnectionError("Сервер закрыл соединение")
+                if is_end(reply):
+                    break
+            runs += 1
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return runs
+
+
+def add_big_file(zip_path, mb):                                             # Несжатый файл: tac читает его блоками прямо из архива
+    with zipfile.ZipFile(zip_path, "a", zipfile.ZIP_STORED) as z:
+        with z.open("big.log", "w", force_zip64=True) as f:
+            for _ in range(0, mb * 1024 * 1024 // len(LINE), 4096):
+                f.write(LINE * 4096)
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+def server_hwm_mb(pid):                                                     # Пиковый RSS процесса сервера (Linux)
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def run_clients(port, clients, requests, targets, heavy):
+    latencies = []
+    stop = asyncio.Event()
+    background = asyncio.ensure_future(heavy_client(port, stop)) if heavy else None
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(client(port, commands(c, requests, targets), latencies) for c in range(clients)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    heavy_runs = await background if background is not None else 0
+    return elapsed, latencies, sum(errors), heavy_runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузка на сервер сессий VFS")
+    parser.add_argument("--clients", type=int, default=50, help="Число одновременных сессий")
+    parser.add_argument("--requests", type=int, default=200, help="Команд на сессию")
+    parser.add_argument("--scale", type=float, default=0.2, help="Размер архива (как в bench_vfs.py)")
+    parser.add_argument("--lazy", action="store_true", help="Запустить сервер с --lazy")
+    parser.add_argument("--tac-mb", type=int, default=0, help="Размер файла для фоновой сессии с tac в МБ (0 - без нее)")
+    parser.add_argument("--out", default="bench_server.json", help="Файл результатов JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        zip_path = os.path.join(tmp, "small.zip")
+        targets = gen_small(zip_path, args.scale)
+        if args.tac_mb > 0:
+            add_big_file(zip_path, args.tac_mb)
+        cmd = [sys.executable, MAIN, "--serve", "0", "--vfs", zip_path] + (["--lazy"] if args.lazy else [])
+        start = time.perf_counter()
+        server = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        try:
+            port = None
+            for line in server.stdout:                                      # Ждем строку о готовности: в ней фактический порт
+                if line.startswith("[server]"):
+                    port = int(line.rsplit(":", 1)[1])
+                    break
+            if port is None:
+                raise RuntimeError("Сервер не запустился")
+            startup = time.perf_counter() - start
+            elapsed, latencies, errors, heavy_runs = asyncio.run(run_clients(port, args.clients, args.requests, targets, args.tac_mb > 0))
+            rss = server_hwm_mb(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+    ordered = sorted(latencies)
+    report = {"python": platform.python_version(), "platform": platform.platform(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "clients": args.clients, "requests_per_client": args.requests, "scale": args.scale, "lazy": args.lazy,
+              "tac_mb": args.tac_mb, "tac_runs": heavy_runs,
+              "server_startup_s": startup, "elapsed_s": elapsed, "requests": len(latencies), "errors": errors,
+              "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+              "latency_ms": {"p50": percentile(ordered, 0.5) * 1000, "p95": percentile(ordered, 0.95) * 1000,
+                             "p99": percentile(ordered, 0.99) * 1000, "max": (ordered[-1] if ordered else 0.0) * 1000},
+              "server_peak_rss_mb": rss}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    lat = report["latency_ms"]
+    print(f"{args.clients} сессий x {args.requests} команд: {report['throughput_rps']:.0f} запросов/с, "
+          f"p50={lat['p50']:.2f}ms p95={lat['p95']:.2f}ms p99={lat['p99']:.2f}ms, ошибок {errors}, "
+          f"RSS сервера {rss if rss is None else f'{rss:.1f} МБ'}")
+    print(f"Результаты: {args.out}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
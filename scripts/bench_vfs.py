@@ -0,0 +1,194 @@
+"""Нагрузочные замеры VFS на синтетических архивах.
+
+Запуск: python scripts/bench_vfs.py [--scale 1.0] [--modes eager,lazy,compact] [--out bench.json]
+        python scripts/bench_vfs.py --compare old.json --threshold 1.25
+
+Генераторы архивов:
+  deep  - цепочка вложенных каталогов с файлом на каждом уровне;
+  wide  - 100 000 файлов в одном каталоге;
+  small - много мелких файлов в 1000 каталогах;
+  huge  - несколько больших сжимаемых файлов.
+Для каждой пары (архив, режим) отдельный процесс загружает VFS и замеряет
+from_zip_file, ls, cd, du_total, head, tac и mkdir -p (лучшее из --repeat
+запусков) и пиковый RSS. Результаты пишутся в JSON; с --compare выводятся
+замеры, ставшие медленнее или тяжелее в --threshold раз, и код возврата 1.
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+try:
+    import resource                                                         # Пиковый RSS; на Windows модуля нет
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from main import VFS                                                        # noqa: E402
+
+NOISE_FLOOR_S = 0.0005                                                      # Операции быстрее этого при сравнении не учитываются: разброс больше самого замера
+LINE = b"the quick brown fox jumps over the lazy dog 0123456789\n"
+
+
+def gen_deep(path, scale):
+    depth = max(1, int(500 * scale))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for i in range(depth):
+            z.writestr("/".join(f"l{j}" for j in range(i + 1)) + "/file.txt", LINE * 20)
+    leaf = "/" + "/".join(f"l{j}" for j in range(depth))
+    return {"dir": leaf, "file": leaf + "/file.txt"}
+
+
+def gen_wide(path, scale):
+    count = max(1, int(100_000 * scale))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as z:
+        for i in range(count):
+            z.writestr(f"wide/f{i:06d}.txt", LINE)
+    return {"dir": "/wide", "file": f"/wide/f{count // 2:06d}.txt"}
+
+
+def gen_small(path, scale):
+    count = max(1, int(200_000 * scale))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for i in range(count):
+            z.writestr(f"d{i % 1000:03d}/s{i}.txt", LINE * 2)
+    return {"dir": "/d500", "file": "/d500/s500.txt"}
+
+
+def gen_huge(path, scale):
+    lines = max(1, int(64 * 1024 * 1024 * scale) // len(LINE))            # ~64 МБ на файл при scale 1
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for i in range(4):
+            with z.open(f"big/h{i}.log", "w", force_zip64=True) as f:
+                for _ in range(0, lines, 4096):
+                    f.write(LINE * 4096)
+    return {"dir": "/big", "file": "/big/h0.log"}
+
+
+GENERATORS = {"deep": gen_deep, "wide": gen_wide, "small": gen_small, "huge": gen_huge}
+MODES = {"eager": {}, "lazy": {"lazy": True}, "compact": {"compact": True}}
+
+
+def best_of(repeat, fn):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024         # macOS - байты, Linux - КБ
+
+
+def run_case(zip_path, mode, targets, repeat):                             # Выполняется в отдельном процессе: RSS не смешивается между замерами
+    start = time.perf_counter()
+    vfs = VFS.from_zip_file(zip_path, **MODES[mode])
+    load = time.perf_counter() - start
+    drain = collections.deque(maxlen=0).extend
+    ops = {
+        "ls": best_of(repeat, lambda i: vfs.ls(targets["dir"])),
+        "cd": best_of(repeat, lambda i: (vfs.cd(targets["dir"]), vfs.cd("/"))),
+        "du_total": best_of(repeat, lambda i: vfs.du_total("/")),
+        "head": best_of(repeat, lambda i: drain(itertools.islice(vfs.iter_lines(targets["file"]), 10))),
+        "tac": best_of(repeat, lambda i: drain(vfs.iter_lines_reversed(targets["file"]))),
+        "mkdir_p": best_of(repeat, lambda i: vfs.mkdir(f"{targets['dir']}/bench{i}/a/b/c", parents=True)),   # Последним: первый mkdir переводит компактную таблицу в VNode
+    }
+    vfs.close()
+    return {"load": load, "ops": ops, "peak_rss_mb": peak_rss_mb()}
+
+
+def compare(old, new, threshold):                                           # Замеры, ухудшившиеся больше чем в threshold раз
+    before = {(r["scenario"], r["mode"]): r for r in old["results"]}
+    regressions = []
+    for r in new["results"]:
+        prev = before.get((r["scenario"], r["mode"]))
+        if prev is None:
+            continue
+        pairs = [("load", prev["load"], r["load"]), ("peak_rss_mb", prev["peak_rss_mb"], r["peak_rss_mb"])]
+        pairs += [(op, prev["ops"].get(op), value) for op, value in r["ops"].items()]
+        for metric, a, b in pairs:
+            if metric != "peak_rss_mb" and b is not None and b < NOISE_FLOOR_S:
+                continue
+            if a and b and b > a * threshold:
+                regressions.append(f"{r['scenario']}/{r['mode']} {metric}: {a:.4g} -> {b:.4g} (x{b / a:.2f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры VFS на синтетических архивах")
+    parser.add_argument("--scale", type=float, default=1.0, help="Множитель размера архивов (0.01 - быстрый прогон)")
+    parser.add_argument("--scenarios", default=",".join(GENERATORS), help="Через запятую: " + ", ".join(GENERATORS))
+    parser.add_argument("--modes", default=",".join(MODES), help="Через запятую: " + ", ".join(MODES))
+    parser.add_argument("--repeat", type=int, default=5, help="Сколько раз повторять каждую операцию (берется лучшее время)")
+    parser.add_argument("--workdir", default=None, help="Каталог для архивов (иначе временный; архивы переиспользуются)")
+    parser.add_argument("--out", default="bench_vfs.json", help="Файл результатов JSON")
+    parser.add_argument("--compare", default=None, help="Прошлый файл результатов для поиска регрессий")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Во сколько раз замер может ухудшиться без сигнала")
+    parser.add_argument("--case", nargs=3, metavar=("ZIP", "MODE", "TARGETS"), help=argparse.SUPPRESS)   # Внутренний вызов дочернего процесса
+    args = parser.parse_args()
+
+    if args.case:
+        zip_path, mode, targets = args.case
+        json.dump(run_case(zip_path, mode, json.loads(targets), args.repeat), sys.stdout)
+        return 0
+
+    tmp = None
+    workdir = args.workdir
+    if workdir is None:
+        tmp = tempfile.TemporaryDirectory()
+        workdir = tmp.name
+    os.makedirs(workdir, exist_ok=True)
+    report = {"python": platform.python_version(), "platform": platform.platform(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "scale": args.scale, "repeat": args.repeat, "results": []}
+    try:
+        for scenario in args.scenarios.split(","):
+            zip_path = os.path.join(workdir, f"{scenario}_{args.scale:g}.zip")
+            targets_path = zip_path + ".json"
+            if os.path.exists(zip_path) and os.path.exists(targets_path):
+                with open(targets_path, encoding="utf-8") as f:
+                    targets = json.load(f)
+            else:
+                print(f"Генерация {scenario}...", file=sys.stderr)
+                targets = GENERATORS[scenario](zip_path, args.scale)
+                with open(targets_path, "w", encoding="utf-8") as f:
+                    json.dump(targets, f)
+            with zipfile.ZipFile(zip_path) as z:
+                entries = len(z.infolist())
+            for mode in args.modes.split(","):
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), "--repeat", str(args.repeat),
+                                      "--case", zip_path, mode, json.dumps(targets)], check=True, capture_output=True, text=True).stdout
+                result = json.loads(out)
+                result.update(scenario=scenario, mode=mode, entries=entries, archive_bytes=os.path.getsize(zip_path))
+                report["results"].append(result)
+                rss = result["peak_rss_mb"]
+                ops = " ".join(f"{op}={t * 1000:.2f}ms" for op, t in result["ops"].items())
+                print(f"{scenario:<6} {mode:<8} load={result['load']:.3f}s rss={rss if rss is None else f'{rss:.1f}MB'} {ops}")
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты: {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for line in regressions:
+            print("РЕГРЕССИЯ", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())